@@ -0,0 +1,208 @@
+from collections import defaultdict
+from itertools import combinations, count
+
+NAME_ATTRIBUTES = ['last_name', 'first_name', 'middle_name']
+
+
+def _is_empty(value):
+    return value is None or len(value) == 0
+
+
+def name_pair_keys(record):
+    """Keys made of every pair of name attributes.
+
+    Records satisfying new group condition always have two equal names, so default predicates lose no pairs.
+    Empty names are equal to anything in predicates, so records with them are not blocked (returns None).
+    """
+    names = [getattr(record, attribute) for attribute in NAME_ATTRIBUTES]
+    if any(_is_empty(name) for name in names):
+        return None
+    return [(i, j, names[i], names[j]) for i, j in combinations(range(len(names)), 2)]
+
+
+def prefix_keys(attribute='last_name', length=3):
+    """Key function factory: first letters of attribute."""
+
+    def key_function(record):
+        value = getattr(record, attribute)
+        if _is_empty(value):
+            return None
+        return [(attribute, 'prefix', value[:length].lower())]
+
+    return key_function
+
+
+def ngram_keys(attribute='last_name', n=3):
+    """Key function factory: all n-grams of attribute. Records sharing any n-gram become candidates."""
+
+    def key_function(record):
+        value = getattr(record, attribute)
+        if _is_empty(value):
+            return None
+        value = value.lower()
+        if len(value) <= n:
+            return [(attribute, 'ngram', value)]
+        return [(attribute, 'ngram', value[i:i + n]) for i in range(len(value) - n + 1)]
+
+    return key_function
+
+
+DEFAULT_BLOCKING_KEYS = [name_pair_keys]
+
+
+def record_keys(record, key_functions):
+    """Set of record's keys or None, if record can't be blocked by any of key functions (or there are no functions)"""
+    if not key_functions:
+        return None
+    result = set()
+    for key_function in key_functions:
+        keys = key_function(record)
+        if keys is None:
+            return None
+        result.update(keys)
+    return result
+
+
+class BlockingIndex:
+    """Inverted index from blocking keys to records of one bucket.
+
+    Key function takes a record and returns an iterable of hashable keys or None, if it can't make keys for it.
+    Records sharing at least one key are candidates. Records without keys are compared with the whole bucket.
+    Key functions must be chosen in accordance with predicates: pairs not sharing keys are never checked.
+    """
+
+    def __init__(self, records, key_functions):
+        self.records = records
+        self.blocks = defaultdict(list)
+        self.unblocked = []
+        for position, record in enumerate(records):
+            keys = record_keys(record, key_functions)
+            if keys is None:
+                self.unblocked.append(position)
+            else:
+                for key in keys:
+                    self.blocks[key].append(position)
+
+    def candidate_positions(self):
+        """Sorted pairs of record positions (i < j), which should be checked with predicates"""
+        pairs = set()
+        for positions in self.blocks.values():
+            pairs.update(combinations(positions, 2))
+        for position in self.unblocked:
+            for other in range(len(self.records)):
+                if other != position:
+                    pairs.add((min(position, other), max(position, other)))
+        return sorted(pairs)
+
+    def candidate_pairs(self):
+        """Pairs of records in the same order as itertools.combinations would give"""
+        return [(self.records[i], self.records[j]) for i, j in self.candidate_positions()]
+
+    def block_sizes(self):
+        """Dictionary of block key and number of records in block. Unblocked records are under None key."""
+        sizes = {key: len(positions) for key, positions in self.blocks.items()}
+        if self.unblocked:
+            sizes[None] = len(self.unblocked)
+        return sizes
+
+
+class _DateBucket:
+    """Groups with the same birth date"""
+
+    def __init__(self):
+        self.groups = set()
+        self.unblocked = set()
+        self.blocks = defaultdict(set)
+
+
+class GroupIndex(dict):
+    """Dictionary of groups and their records (see Group.get_dictionary) with an index for GroupRecord.seek_for_group.
+
+    Groups are indexed by birth date and by blocking keys of all their records.
+    Undated groups are candidates for any record and undated records are candidates for any group.
+    Add records with add_record (or add_record_to_group_dict) to keep the index up to date.
+    Keys of removed records are kept, so the index may give extra candidates, but never misses one.
+    """
+
+    def __init__(self, group_dict=None, key_functions=DEFAULT_BLOCKING_KEYS):
+        super().__init__()
+        self.key_functions = key_functions
+        self._positions = {}
+        self._counter = count()
+        self._dates = {}
+        self._group_keys = {}
+        if group_dict:
+            for group, records in group_dict.items():
+                self[group] = records
+
+    def __setitem__(self, group, records):
+        if group in self:
+            self._remove_from_index(group)
+        super().__setitem__(group, records)
+        self._positions[group] = next(self._counter)
+        self._group_keys[group] = set()
+        self._dates.setdefault(group.birth_date, _DateBucket()).groups.add(group)
+        for record in records:
+            self._add_to_index(group, record)
+
+    def __delitem__(self, group):
+        self._remove_from_index(group)
+        super().__delitem__(group)
+
+    def pop(self, group, *args):
+        if group in self:
+            self._remove_from_index(group)
+        return super().pop(group, *args)
+
+    def _add_to_index(self, group, record):
+        bucket = self._dates[group.birth_date]
+        keys = record_keys(record, self.key_functions)
+        if keys is None:
+            bucket.unblocked.add(group)
+        else:
+            for key in keys:
+                bucket.blocks[key].add(group)
+            self._group_keys[group].update(keys)
+
+    def _remove_from_index(self, group):
+        bucket = self._dates[group.birth_date]
+        bucket.groups.discard(group)
+        bucket.unblocked.discard(group)
+        for key in self._group_keys.pop(group):
+            bucket.blocks[key].discard(group)
+            if len(bucket.blocks[key]) == 0:
+                del bucket.blocks[key]
+        del self._positions[group]
+
+    def add_record(self, group, record):
+        if group in self:
+            self[group].append(record)
+            self._add_to_index(group, record)
+        else:
+            self[group] = [record]
+
+    def candidates(self, record):
+        """Groups, which may satisfy predicates for the record, in order of their addition to the index"""
+        keys = record_keys(record, self.key_functions)
+        if record.birth_date is None:
+            buckets = self._dates.values()
+        else:
+            buckets = [bucket for bucket in (self._dates.get(record.birth_date), self._dates.get(None))
+                       if bucket is not None]
+        result = set()
+        for bucket in buckets:
+            if keys is None:
+                result.update(bucket.groups)
+            else:
+                result.update(bucket.unblocked)
+                for key in keys:
+                    result.update(bucket.blocks.get(key, ()))
+        return sorted(result, key=self._positions.__getitem__)
+
+
+def add_record_to_group_dict(group_dict, group, record):
+    """Append record to group's list both for plain dictionaries and GroupIndex"""
+    if isinstance(group_dict, GroupIndex):
+        group_dict.add_record(group, record)
+    else:
+        group_dict.setdefault(group, []).append(record)
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from django.db import connection, transaction
+from bulk_update.helper import bulk_update
+
+
+def reserve_ids(model, number):
+    """Take number of next values from the model's id sequence in one query (PostgreSQL only)"""
+    if number == 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                       [model._meta.db_table, model._meta.pk.column, number])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class WriteBuffer:
+    """Unit of work: collects creates and updates and writes them with bulk queries in one transaction.
+
+    Created objects get their ids at once (see reserve_ids), so they can be referenced before flush.
+    Updates of objects waiting for creation are not needed: they are inserted with their state at the time of flush.
+    Use as a context manager to flush on exit, nothing is written if an exception is raised.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+        # Objects by models and by pairs of models and updated fields, handled in order of their first appearance
+        self._creates = OrderedDict()
+        self._updates = OrderedDict()
+        self._created = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def create(self, model, objects):
+        """Reserve ids for objects of the model and put them in the queue for creation"""
+        objects = list(objects)
+        for obj, pk in zip(objects, reserve_ids(model, len(objects))):
+            obj.pk = pk
+            self._created.add((model, pk))
+        self._creates.setdefault(model, []).extend(objects)
+        return objects
+
+    def update(self, objects, update_fields):
+        """Put objects in the queue for bulk_update.
+
+        Only update_fields are written for these objects, objects of one model with the same fields are written together.
+        """
+        key_fields = frozenset(update_fields)
+        for obj in objects:
+            model = type(obj)
+            if (model, obj.pk) in self._created:
+                continue
+            self._updates.setdefault((model, key_fields), OrderedDict())[obj.pk] = obj
+
+    def __len__(self):
+        return sum(len(objects) for objects in self._creates.values()) + \
+            sum(len(objects) for objects in self._updates.values())
+
+    def flush(self):
+        """Write everything in one transaction (no savepoint inside outer one): creates, then updates"""
+        with transaction.atomic(savepoint=False):
+            for model, objects in self._creates.items():
+                model.objects.bulk_create(objects, batch_size=self.batch_size)
+            for (model, update_fields), objects in self._updates.items():
+                bulk_update(list(objects.values()), update_fields=sorted(update_fields), batch_size=self.batch_size)
+        self._creates.clear()
+        self._updates.clear()
+        self._created.clear()
+
+
+def queryset_chunks(queryset, chunk_size=10000):
+    """Lists of at most chunk_size objects of queryset, loaded by primary key ranges one query per chunk.
+
+    Only one chunk is in memory at once. Objects come in order of primary key.
+    """
+    last_pk = None
+    while True:
+        chunk_queryset = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_queryset[:chunk_size])
+        if len(chunk) == 0:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
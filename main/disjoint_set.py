@@ -0,0 +1,55 @@
+class DisjointSet:
+    """Union-find over hashable elements with path compression and union by size.
+
+    Components are returned in order of the first appearance of their elements, so results don't depend on
+    the order of unions.
+    """
+
+    def __init__(self, elements=()):
+        self._parent = {}
+        self._size = {}
+        for element in elements:
+            self.add(element)
+
+    def __contains__(self, element):
+        return element in self._parent
+
+    def __len__(self):
+        return len(self._parent)
+
+    def add(self, element):
+        if element not in self._parent:
+            self._parent[element] = element
+            self._size[element] = 1
+
+    def find(self, element):
+        """Root of the element's component. Unknown elements are added as separate components."""
+        self.add(element)
+        root = element
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[element] != root:
+            self._parent[element], element = root, self._parent[element]
+        return root
+
+    def union(self, a, b):
+        """Join components of a and b. Returns the root of the joined component."""
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self._size[root_a] < self._size[root_b]:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._size[root_a] += self._size[root_b]
+        return root_a
+
+    def connected(self, a, b):
+        return self.find(a) == self.find(b)
+
+    def components(self, min_size=1):
+        """List of components (lists of elements) with at least min_size elements"""
+        by_root = {}
+        for element in self._parent:
+            by_root.setdefault(self.find(element), []).append(element)
+        return [component for component in by_root.values() if len(component) >= min_size]
@@ -0,0 +1,32 @@
+class ForbiddenRelations:
+    """In-memory copy of forbidden records and forbidden groups of group records.
+
+    Made by GroupRecord.get_forbidden_relations with two queries.
+    Pass it as "forbidden" keyword to predicates and merge procedures, so they don't query the database per comparison.
+    Keep it in sync with the database by calling forbid_* and allow_* methods along with the changes.
+    """
+
+    def __init__(self, record_pairs=(), group_pairs=()):
+        self._record_pairs = set(record_pairs)
+        self._group_pairs = set(group_pairs)
+
+    def records_forbidden(self, record, another_record):
+        return (record.id, another_record.id) in self._record_pairs
+
+    def group_forbidden(self, record, group):
+        return (record.id, group.id) in self._group_pairs
+
+    def forbid_records(self, record, another_record):
+        """Forbidden records relation is symmetrical"""
+        self._record_pairs.add((record.id, another_record.id))
+        self._record_pairs.add((another_record.id, record.id))
+
+    def allow_records(self, record, another_record):
+        self._record_pairs.discard((record.id, another_record.id))
+        self._record_pairs.discard((another_record.id, record.id))
+
+    def forbid_group(self, record, group):
+        self._group_pairs.add((record.id, group.id))
+
+    def allow_group(self, record, group):
+        self._group_pairs.discard((record.id, group.id))
@@ -1,97 +1,279 @@
-from main.models import Person, Hypostasis, GroupRecord, Group
-from itertools import groupby, combinations
-from datetime import date
-from bulk_update.helper import bulk_update
+from main.models import Person, Hypostasis, GroupRecord, Group, MergeRun, CompactRecord
+from main.blocking import BlockingIndex, GroupIndex, DEFAULT_BLOCKING_KEYS, add_record_to_group_dict
+from main.bulk import WriteBuffer
+from main.disjoint_set import DisjointSet
+from main.vectorized import VectorizedPredicates
+from main import similarity
+from itertools import combinations, chain
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.query import QuerySet
+from django.utils import timezone
 from time import time
+import multiprocessing
+import os
 
 
 def create_new_groups(*args, **kwargs):
     """Puts records into new groups if they do not have one yet and can meld with one another.
 
     Each record will have only one group (person) or none if it's alone.
+    Groups are connected components of matching pairs, so records linked through other records share a group.
     Predicate methods must contain one or more method names from GroupRecord class.
     Predicate methods must be defined and maintained in GroupRecord model.
     Call with "satisfies_new_group_condition" to form new groups.
+    Only records sharing a blocking key (see main.blocking) are compared. Pass blocking_keys=None to compare all pairs.
+    If group_dict is passed, new groups are added to it.
+    New groups, records and their inconsistency flags are written in one transaction.
+    Pass vectorized=True to check predicates for whole date groups on arrays (see main.vectorized).
+    Date groups are matched in "workers" processes (MERGE_WORKERS setting by default), results are the same for
+    any number of workers. Small date groups are sent to workers in batches of at least "batch_size" records.
+    Pass a set of record ids as "changed" to check only pairs with at least one changed record (incremental mode).
+    Records are streamed date group by date group (see GroupRecord.iterate_by_birth_date) as CompactRecord
+    instances, only matching ones are kept in memory till the end and written back.
     """
-
-    def key_function(gr):
-        """For sorting by birth date"""
-        if gr.birth_date is None:
-            return date.today()
-        else:
-            return gr.birth_date
-
     predicate_methods = kwargs.pop('predicate_methods', ['satisfies_new_group_condition', 'not_forbidden'])
     if len(predicate_methods) == 0:
         raise AttributeError("Predicate methods must contain at least one method")
+    blocking_keys = kwargs.pop('blocking_keys', DEFAULT_BLOCKING_KEYS)
+    group_dict = kwargs.pop('group_dict', None)
+    vectorized = kwargs.pop('vectorized', False)
+    workers = kwargs.pop('workers', settings.MERGE_WORKERS)
+    batch_size = kwargs.pop('batch_size', settings.MERGE_BATCH_SIZE)
+    changed = kwargs.pop('changed', None)
+    if kwargs.get('forbidden', None) is None:
+        print("Loading forbidden relations")
+        kwargs['forbidden'] = GroupRecord.get_forbidden_relations()
     print("Starting creation of new groups")
-    print("Extracting records")
-    key = key_function
-    unresolved_records = list(GroupRecord.objects.filter(group__isnull=True))
-    unresolved_records.sort(key=key)
-    record_groups = []
-    print("Sorting")
-    for k, g in groupby(unresolved_records, key=key):
-        record_groups.append(list(g))
-    records_to_update = []
-    groups_to_update = []
+    record_groups = GroupRecord.iterate_by_birth_date(GroupRecord.objects.filter(group__isnull=True), compact=True)
+    disjoint_set = DisjointSet()
+    block_sizes = []
+    total_pairs = 0
+    candidate_pairs_count = 0
+    matcher = BucketMatcher(predicate_methods, blocking_keys, vectorized, changed, **kwargs)
     print("Iterating through groups")
     cntr = 0
-    total = len(record_groups)
-    for same_date_group in record_groups:
+    for same_date_group, (positions, candidates_count, bucket_block_sizes) in \
+            matcher.results(record_groups, workers, batch_size):
         cntr += 1
         if cntr % 100 == 0:
-            print("{} of {} date groups handled".format(cntr, total))
-        new_groups = []
-        for record_pair in combinations(same_date_group, 2):
-            a = record_pair[0]
-            b = record_pair[1]
-            if a.check_predicates(predicate_methods=predicate_methods, another_record=b, **kwargs):
-                a_in_group = False
-                b_in_group = False
-                new_group = None
-                if a.group is not None and a.group in new_groups:
-                    a_in_group = True
-                    new_group = a.group
-                if b.group is not None and b.group in new_groups:
-                    b_in_group = True
-                    new_group = b.group
-                if new_group is None:
-                    new_group = Group()
-                    new_groups.append(new_group)
-                    new_group.save()
-                if not a_in_group:
-                    a.group = new_group
-                    records_to_update.append(a)
-                if not b_in_group:
-                    b.group = new_group
-                    records_to_update.append(b)
-        groups_to_update.extend(new_groups)
-        for group in new_groups:
-            for record in same_date_group:
-                if record.group == group and record.birth_date is not None:
-                    group.birth_date = record.birth_date
-        bulk_update(new_groups, update_fields=['birth_date'])
-    print("Have {0} records to save".format(len(records_to_update)))
-    bulk_update(records_to_update, update_fields=['group'])
-    print("Have {0} groups to update inconsistency".format(len(groups_to_update)))
-    mark_inconsistency(groups_to_update)
+            print("{} date groups handled".format(cntr))
+        total_pairs += len(same_date_group) * (len(same_date_group) - 1) // 2
+        candidate_pairs_count += candidates_count
+        bucket_key = GroupRecord.birth_date_key(same_date_group[0])
+        block_sizes.extend((size, bucket_key, block) for block, size in bucket_block_sizes)
+        for i, j in positions:
+            disjoint_set.union(same_date_group[i], same_date_group[j])
+    print("{0} of {1} pairs checked".format(candidate_pairs_count, total_pairs))
+    report_block_sizes(block_sizes)
+    components = disjoint_set.components()
+    print("Creating {0} groups".format(len(components)))
+    new_groups = []
+    for component in components:
+        birth_dates = [record.birth_date for record in component if record.birth_date is not None]
+        new_groups.append(Group(birth_date=birth_dates[0] if birth_dates else None))
+    with transaction.atomic():
+        with WriteBuffer() as write_buffer:
+            write_buffer.create(Group, new_groups)
+            records_to_update = []
+            for group, component in zip(new_groups, components):
+                for record in component:
+                    record.group = group
+                    records_to_update.append(record)
+                if group_dict is not None:
+                    group_dict[group] = component
+            print("Have {0} records to save".format(len(records_to_update)))
+            GroupRecord.touch(records_to_update)
+            write_buffer.update(CompactRecord.to_models(records_to_update), update_fields=['group', 'modified'])
+            print("Saving")
+        print("Have {0} groups to update inconsistency".format(len(new_groups)))
+        mark_inconsistency(new_groups)
+    if not matcher.uses_workers(workers):
+        # Caches of workers are not seen here
+        similarity.report_cache()
     print("Creation of new groups: done")
 
 
-def distribute_records_among_existing_groups(**kwargs):
+class BucketMatcher:
+    """Finds matching pairs of records inside date groups for create_new_groups.
+
+    Matching needs no database access, so date groups can be handled in worker processes. Workers are forked
+    and inherit the matcher with predicates and forbidden relations, only date groups and results are sent
+    between processes. With other start methods of processes date groups are matched in this process.
+    """
+
+    def __init__(self, predicate_methods, blocking_keys, vectorized=False, changed=None, **kwargs):
+        self.blocking_keys = blocking_keys
+        self.changed = changed
+        self.matches = GroupRecord.compile_predicates(predicate_methods, **kwargs)
+        self.vectorized_predicates = VectorizedPredicates(predicate_methods, **kwargs) if vectorized else None
+
+    def has_changes(self, same_date_group):
+        return self.changed is None or any(record.id in self.changed for record in same_date_group)
+
+    def match(self, same_date_group):
+        """Tuple of matching (i, j) positions in date group, number of checked pairs and block sizes"""
+        changed = self.changed
+        if not self.has_changes(same_date_group):
+            return [], 0, []
+        if self.blocking_keys:
+            blocking_index = BlockingIndex(same_date_group, self.blocking_keys)
+            positions = blocking_index.candidate_positions()
+            candidates_count = len(positions)
+            block_sizes = [(block, size) for block, size in blocking_index.block_sizes().items()
+                           if size > 1 or block is None]
+        else:
+            positions = None
+            candidates_count = len(same_date_group) * (len(same_date_group) - 1) // 2
+            block_sizes = []
+        if changed is not None:
+            if positions is None:
+                positions = combinations(range(len(same_date_group)), 2)
+            positions = [(i, j) for i, j in positions
+                         if same_date_group[i].id in changed or same_date_group[j].id in changed]
+            candidates_count = len(positions)
+        if self.vectorized_predicates is not None:
+            matching_positions = self.vectorized_predicates.matching_positions(same_date_group, positions)
+        else:
+            if positions is None:
+                positions = combinations(range(len(same_date_group)), 2)
+            matches = self.matches
+            matching_positions = [(i, j) for i, j in positions if matches(same_date_group[i], same_date_group[j])]
+        return matching_positions, candidates_count, block_sizes
+
+    def match_batch(self, record_groups):
+        return [self.match(same_date_group) for same_date_group in record_groups]
+
+    @staticmethod
+    def uses_workers(workers):
+        """Date groups are sent to workers only if there are several of them and processes are forked"""
+        return workers is not None and workers > 1 and multiprocessing.get_start_method() == 'fork'
+
+    def batches(self, record_groups, batch_size):
+        """Lists of consecutive date groups with at least batch_size records (except the last one).
+
+        Date groups without changed records are kept in batches, but they are not sent to workers in incremental mode.
+        """
+        batch = []
+        records_count = 0
+        for same_date_group in record_groups:
+            batch.append(same_date_group)
+            records_count += len(same_date_group)
+            if records_count >= batch_size:
+                yield batch
+                batch = []
+                records_count = 0
+        if batch:
+            yield batch
+
+    def results(self, record_groups, workers=1, batch_size=1):
+        """Pairs of date group and result of match in order of record_groups (any iterable of lists of records).
+
+        Not more than two batches per worker are in progress, so date groups are read from record_groups lazily.
+        """
+        global _bucket_matcher
+        if not self.uses_workers(workers):
+            if workers is not None and workers > 1:
+                print("Processes are not forked, matching without workers")
+            for same_date_group in record_groups:
+                yield same_date_group, self.match(same_date_group)
+            return
+        # Workers are forked on the first submit, after records are read, and drop inherited database connections
+        _bucket_matcher = self
+        pending = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for batch in self.batches(record_groups, batch_size):
+                    changed_groups = [same_date_group for same_date_group in batch if self.has_changes(same_date_group)]
+                    pending.append((batch, executor.submit(_match_batch, changed_groups)))
+                    if len(pending) >= 2 * workers:
+                        batch, future = pending.popleft()
+                        yield from self._batch_results(batch, future.result())
+                while pending:
+                    batch, future = pending.popleft()
+                    yield from self._batch_results(batch, future.result())
+        finally:
+            _bucket_matcher = None
+
+    def _batch_results(self, batch, changed_results):
+        """Pairs of date group and result for the whole batch, unchanged date groups get empty results"""
+        changed_results = iter(changed_results)
+        for same_date_group in batch:
+            if self.has_changes(same_date_group):
+                yield same_date_group, next(changed_results)
+            else:
+                yield same_date_group, ([], 0, [])
+
+
+_bucket_matcher = None
+# Database connections of the parent process inherited by a worker and the id of the worker process
+_inherited_connections = []
+_worker_pid = None
+
+
+def _drop_inherited_connections():
+    """Runs in worker processes before the first batch.
+
+    Connections are shared with the parent process, so they are neither used nor closed here. They are kept
+    referenced, otherwise garbage collection of the driver connection would terminate the parent's session.
+    """
+    global _worker_pid
+    if _worker_pid != os.getpid():
+        _worker_pid = os.getpid()
+        for conn in connections.all():
+            if conn.connection is not None:
+                _inherited_connections.append(conn.connection)
+                conn.connection = None
+
+
+def _match_batch(record_groups):
+    """Runs in worker processes"""
+    _drop_inherited_connections()
+    return _bucket_matcher.match_batch(record_groups)
+
+
+def report_block_sizes(block_sizes, limit=10):
+    """Print the largest blocks. block_sizes is a list of (size, bucket key, block key) tuples"""
+    if len(block_sizes) == 0:
+        return
+    print("{0} blocks, the largest are:".format(len(block_sizes)))
+    for size, bucket_key, block_key in sorted(block_sizes, key=lambda item: item[0], reverse=True)[:limit]:
+        if block_key is None:
+            print("{0}: {1} unblocked records compared with the whole date group".format(bucket_key, size))
+        else:
+            print("{0}: {1} records ({2} pairs) in {3}".format(bucket_key, size, size * (size - 1) // 2, block_key))
+
+
+def distribute_records_among_existing_groups(group_dict=None, records=None, **kwargs):
+    """Put records without group into suitable existing groups. Found records are added to group_dict and returned.
+
+    All records without group are handled by default, pass a queryset or an iterable of them as "records"
+    to handle only them. Querysets are streamed date group by date group (see GroupRecord.iterate_by_birth_date)
+    as CompactRecord instances.
+    """
     print("Starting distribution among existing groups")
-    print("Extracting records")
-    unresolved_records = list(GroupRecord.objects.filter(group__isnull=True))
-    print("Making dictionary of groups")
-    group_dict = Group.get_dictionary()
+    if records is None:
+        records = GroupRecord.objects.filter(group__isnull=True)
+    if isinstance(records, QuerySet):
+        ttl = records.count()
+        unresolved_records = chain.from_iterable(GroupRecord.iterate_by_birth_date(records, compact=True))
+    else:
+        ttl = len(records)
+        unresolved_records = records
+    if group_dict is None:
+        print("Making index of groups")
+        group_dict = Group.get_index()
+    if kwargs.get('forbidden', None) is None:
+        print("Loading forbidden relations")
+        kwargs['forbidden'] = GroupRecord.get_forbidden_relations()
     if len(group_dict) == 0:
         print("No groups found. Finishing")
-        return
+        return []
     records_to_update = []
     groups_to_update = set()
     print("Handling records")
-    ttl = len(unresolved_records)
     cntr = 0
     now = time()
     for record in unresolved_records:
@@ -105,50 +287,83 @@ def distribute_records_among_existing_groups(**kwargs):
             records_to_update.append(record)
             groups_to_update.add(suitable_group)
     print("Have {0} records to update".format(len(records_to_update)))
-    if len(records_to_update) > 0:
-        bulk_update(records_to_update, update_fields=['group'])
-    print("Have {0} groups to update".format(len(groups_to_update)))
-    if len(groups_to_update) > 0:
-        mark_inconsistency(groups=list(groups_to_update))
+    with transaction.atomic():
+        if len(records_to_update) > 0:
+            GroupRecord.touch(records_to_update)
+            with WriteBuffer() as write_buffer:
+                write_buffer.update(CompactRecord.to_models(records_to_update), update_fields=['group', 'modified'])
+            for record in records_to_update:
+                add_record_to_group_dict(group_dict, record.group, record)
+        print("Have {0} groups to update".format(len(groups_to_update)))
+        if len(groups_to_update) > 0:
+            mark_inconsistency(groups=list(groups_to_update))
+    similarity.report_cache()
     print("Distribution among existing groups: done")
+    return records_to_update
 
 
-def mark_inconsistency(groups=None, group_dict=None):
-    """Update inconsistency flag of chosen groups"""
+def distribute_changed_records(since, group_dict=None, **kwargs):
+    """Incremental version of distribute_records_among_existing_groups for records modified since chosen time.
+
+    Records without group compared with unchanged groups during previous runs are compared only with changed groups,
+    changed records are compared with all groups. Returns ids of records modified since chosen time.
+    """
+    print("Extracting records changed since {}".format(since))
+    changed_records = GroupRecord.objects.filter(modified__gte=since)
+    changed = set(changed_records.values_list('id', flat=True))
+    changed_group_ids = set(changed_records.filter(group__isnull=False).values_list('group_id', flat=True))
+    # Groups, which lost records or changed inconsistency flag
+    changed_group_ids.update(Group.objects.filter(modified__gte=since).values_list('id', flat=True))
+    changed_unresolved = changed_records.filter(group__isnull=True)
+    unchanged_unresolved = GroupRecord.objects.filter(group__isnull=True).exclude(modified__gte=since)
+    if group_dict is None:
+        print("Making index of groups")
+        group_dict = Group.get_index()
+    found_records = distribute_records_among_existing_groups(group_dict=group_dict, records=changed_unresolved,
+                                                             **kwargs)
+    changed_group_ids.update(record.group.id for record in found_records)
+    changed_groups = [group for group in group_dict.keys() if group.id in changed_group_ids]
+    print("{} of {} groups changed".format(len(changed_groups), len(group_dict)))
+    if len(changed_groups) > 0:
+        changed_group_dict = GroupIndex({group: list(group_dict[group]) for group in changed_groups},
+                                        key_functions=getattr(group_dict, 'key_functions', DEFAULT_BLOCKING_KEYS))
+        found_records = distribute_records_among_existing_groups(group_dict=changed_group_dict,
+                                                                 records=unchanged_unresolved, **kwargs)
+        for record in found_records:
+            add_record_to_group_dict(group_dict, record.group, record)
+    return changed
 
-    def check_group_consistency(group_record_list):
-        """Returns True, if all records in list are fully equal"""
-        first = group_record_list[0]
-        for other in group_record_list[1:]:
-            if not first.completely_equal_for_consistency(another_record=other):
-                return False
-        return True
 
+def mark_inconsistency(groups=None, group_dict=None):
+    """Update inconsistency flag of chosen groups (all groups by default) in the database and in memory.
+
+    Consistency is computed by one aggregated query (see Group.get_inconsistent_ids), so records must be saved.
+    Flags are changed by two UPDATE queries, changed groups are marked as modified.
+    Instances in groups and in group_dict keys get new flags too.
+    """
     print("Starting procedure of inconsistency marking")
-    if group_dict is None:
-        print("Making dictionary of groups")
-        group_dict = Group.get_dictionary()
-    groups_to_update = set()
-    print("Iterating through groups")
-    if groups is None:
-        groups = group_dict.keys()
-    else:
+    if groups is not None:
+        groups = list(groups)
         for group in groups:
             if not isinstance(group, Group):
                 raise TypeError("groups must contain Group instances")
-    for group in groups:
-        records = group_dict[group]
-        if check_group_consistency(group_record_list=records):
-            if group.inconsistent:
-                group.inconsistent = False
-                groups_to_update.add(group)
+    print("Counting distinct values in groups")
+    inconsistent_ids = Group.get_inconsistent_ids(groups)
+    print("{} inconsistent groups found".format(len(inconsistent_ids)))
+    now = timezone.now()
+    with transaction.atomic(savepoint=False):
+        marked = Group.objects.filter(id__in=inconsistent_ids, inconsistent=False)\
+            .update(inconsistent=True, modified=now)
+        if groups is None:
+            unmarked = Group.objects.filter(inconsistent=True).exclude(id__in=inconsistent_ids)\
+                .update(inconsistent=False, modified=now)
         else:
-            if not group.inconsistent:
-                group.inconsistent = True
-                groups_to_update.add(group)
-    print("In-memory changes done")
-    print("{} groups will be changed".format(len(groups_to_update)))
-    bulk_update(list(groups_to_update), update_fields=['inconsistent'])
+            consistent_ids = [group.id for group in groups if group.id not in inconsistent_ids]
+            unmarked = Group.objects.filter(id__in=consistent_ids, inconsistent=True)\
+                .update(inconsistent=False, modified=now)
+    print("{} groups marked as inconsistent, {} as consistent".format(marked, unmarked))
+    for group in chain(groups or [], group_dict or []):
+        group.inconsistent = group.id in inconsistent_ids
     print("Inconsistency marking: done")
 
 
@@ -173,21 +388,41 @@ def merge_consistent_groups(group_dict=None):
             hypostases_for_update.extend(changed_hypostases)
             records_for_update.extend(changed_records)
             persons_to_delete = persons_to_delete.union(unnecessary_persons)
+    persons_to_delete.discard(None)
     print("Saving")
-    bulk_update(records_for_update, update_fields=['person'])
-    bulk_update(hypostases_for_update, update_fields=['person'])
-    bulk_update(list(group_dict.keys()), update_fields=['person'])
-    for person in persons_to_delete:
-        person.delete()
+    with transaction.atomic():
+        with WriteBuffer() as write_buffer:
+            write_buffer.update(records_for_update, update_fields=['person'])
+            write_buffer.update(hypostases_for_update, update_fields=['person'])
+            write_buffer.update(groups_for_update, update_fields=['person'])
+        print("Deleting persons")
+        deleted, kept = Person.delete_orphans(persons_to_delete)
+    print("{} of {} persons deleted, {} are still referenced".format(deleted, len(persons_to_delete), kept))
     print("Consistent groups merge: done")
 
 
-def full_update():
-    """At first compares orphan records with existing groups. Then tries to make new groups from remaining records."""
+def full_update(incremental=False):
+    """At first compares orphan records with existing groups. Then tries to make new groups from remaining records.
+
+    With incremental=True only records modified since the start of the last finished run (see MergeRun) are
+    handled: pairs of unchanged records were already compared. The first run is always a full one.
+    """
     print("Starting full update")
+    similarity.clear_cache()
     start = time()
-    distribute_records_among_existing_groups()
+    since = MergeRun.get_watermark() if incremental else None
+    run = MergeRun.objects.create(started=timezone.now(), incremental=since is not None)
+    group_dict = Group.get_index()
+    forbidden = GroupRecord.get_forbidden_relations()
+    if since is None:
+        distribute_records_among_existing_groups(group_dict=group_dict, forbidden=forbidden)
+        changed = None
+    else:
+        print("Incremental mode")
+        changed = distribute_changed_records(since, group_dict=group_dict, forbidden=forbidden)
     distribute = time()
-    create_new_groups()
+    create_new_groups(group_dict=group_dict, forbidden=forbidden, changed=changed)
     end = time()
+    run.finished = timezone.now()
+    run.save()
     print("{} seconds for distribution\n{} seconds for creation".format(distribute - start, end - distribute))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_grouprecord_instance_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MergeRun',
+            fields=[
+                ('id', models.AutoField(serialize=False, auto_created=True, verbose_name='ID', primary_key=True)),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(null=True)),
+                ('incremental', models.BooleanField(default=False)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='grouprecord',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, null=True, db_index=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_grouprecord_modified_mergerun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemoteSnapshot',
+            fields=[
+                ('id', models.AutoField(serialize=False, auto_created=True, verbose_name='ID', primary_key=True)),
+                ('instance_type', models.CharField(max_length=255)),
+                ('remote_id', models.CharField(max_length=255)),
+                ('last_name', models.CharField(max_length=255, null=True)),
+                ('first_name', models.CharField(max_length=255, null=True)),
+                ('middle_name', models.CharField(max_length=255, null=True)),
+                ('date_birth', models.DateField(null=True)),
+                ('valid_from', models.DateField(null=True)),
+                ('valid_to', models.DateField(null=True)),
+                ('synced', models.DateTimeField(db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='remotesnapshot',
+            unique_together=set([('instance_type', 'remote_id')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_remotesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, null=True, db_index=True),
+            preserve_default=True,
+        ),
+    ]
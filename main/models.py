@@ -1,12 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Max, Q
+from datetime import date
+from django.utils import timezone
 from main_remote.models import Student, Employee, Postgraduate
 from bulk_update.helper import bulk_update
 from main.exceptions import HypostasisIntegrityError, GroupError
 from cached_property import cached_property_ttl
-from inspect import getmembers, ismethod
-from jellyfish import jaro_winkler, levenshtein_distance
 from itertools import combinations
+from collections import OrderedDict
 from main.decorators import predicate
+from main.blocking import GroupIndex, DEFAULT_BLOCKING_KEYS, add_record_to_group_dict
+from main.forbidden import ForbiddenRelations
+from main.predicates import CompiledPredicates, get_predicate_functions
+from main.similarity import are_close, DEFAULT_TOLERANCE
+from main.bulk import WriteBuffer
 
 
 class Person(models.Model):
@@ -31,34 +38,67 @@ class Person(models.Model):
 
     def get_actual_instance(self):
         """Get instance (remote object) with the latest valid_to date in related object."""
-
-        def latest_instance(instance_list):
-            """Instance without valid_to date is, probably, actual, otherwise, get one with the latest as actual."""
-            res = instance_list[0]
-            date = instance_list[0].valid_to
-            for instance in instance_list:
-                new_date = instance.valid_to
-                if new_date is None:
-                    return instance
-                elif new_date > date:
-                    date = new_date
-                    res = instance
-            return res
-
-        hypos_list = self.hypostasis_set.all()
-        instances = [x.non_empty_instance for x in hypos_list]
-        return latest_instance(instances)
+        return self._get_actual_hypostasis_and_instance()[1]
 
     def get_actual_hypostasis(self):
         """Get hypostasis with the latest date for this person"""
-        instance = self.get_actual_instance()
-        for hypostasis in self.hypostasis_set.all():
-            if hypostasis.non_empty_instance == instance:
-                return hypostasis
+        return self._get_actual_hypostasis_and_instance()[0]
+
+    def _get_actual_hypostasis_and_instance(self):
+        """Hypostasis with the actual instance and the instance, instances of all hypostases are fetched at once.
+
+        Instance without valid_to date is, probably, actual, otherwise, get one with the latest as actual.
+        """
+        hypos_list = Hypostasis.resolve_instances(self.hypostasis_set.all())
+        res = hypos_list[0]
+        date = res.non_empty_instance.valid_to
+        for hypostasis in hypos_list:
+            new_date = hypostasis.non_empty_instance.valid_to
+            if new_date is None:
+                return hypostasis, hypostasis.non_empty_instance
+            elif new_date > date:
+                date = new_date
+                res = hypostasis
+        return res, res.non_empty_instance
 
     def __str__(self):
         return "{0} {1} {2}".format(self.last_name, self.first_name, self.middle_name)
 
+    @staticmethod
+    def delete_orphans(persons=None, batch_size=1000):
+        """Delete persons not referenced by any hypostasis. Returns numbers of deleted and kept persons.
+
+        Candidates are chosen persons (instances or ids) or all persons by default.
+        Orphans are found with one aggregated query and deleted by batches with QuerySet.delete, so the collector
+        handles all relations and signals. Groups of orphans are deleted by cascade as before.
+        Group records referencing orphans or their groups get null person or group and are marked as modified
+        beforehand, the collector doesn't change "modified".
+        """
+        if persons is None:
+            batches = [Person.objects.all()]
+        else:
+            ids = sorted({person if isinstance(person, int) else person.id for person in persons if person is not None})
+            batches = [Person.objects.filter(id__in=ids[i:i + batch_size]) for i in range(0, len(ids), batch_size)]
+        deleted = 0
+        kept = 0
+        for candidates in batches:
+            counts = candidates.annotate(hypostasis_count=Count('hypostasis'))
+            orphans = []
+            for person_id, hypostasis_count in counts.values_list('id', 'hypostasis_count'):
+                if hypostasis_count > 0:
+                    kept += 1
+                else:
+                    orphans.append(person_id)
+            # Records are touched, so incremental runs match records which lost their groups with all groups
+            now = timezone.now()
+            for i in range(0, len(orphans), batch_size):
+                batch = orphans[i:i + batch_size]
+                GroupRecord.objects.filter(person_id__in=batch).update(person=None, modified=now)
+                GroupRecord.objects.filter(group__person_id__in=batch).update(group=None, modified=now)
+                Person.objects.filter(id__in=batch).delete()
+            deleted += len(orphans)
+        return deleted, kept
+
 
 class Hypostasis(models.Model):
     """One part of the person's activity: student, employee or postgraduate."""
@@ -112,6 +152,26 @@ class Hypostasis(models.Model):
         nonempty_id = self.non_empty_id
         return remote_model.objects.get(pk=nonempty_id)
 
+    @staticmethod
+    def resolve_instances(hypostases, batch_size=None):
+        """Fetch related remote instances of many hypostases at once and cache them as non_empty_instance.
+
+        Instances are requested with in_bulk of each remote model (filters by list of ids and cached responses)
+        instead of one request per hypostasis, batch_size limits number of ids in one request (by default it is
+        chosen by in_bulk to fit in the server's query length). Hypostases without found instance are left as is.
+        Returns list of hypostases.
+        """
+        hypostases = list(hypostases)
+        by_class = {}
+        for hypostasis in hypostases:
+            by_class.setdefault(hypostasis.remote_class, {}).setdefault(hypostasis.non_empty_id, []) \
+                .append(hypostasis)
+        for remote_model, by_id in by_class.items():
+            for remote_id, instance in remote_model.objects.in_bulk(list(by_id.keys()), batch_size=batch_size).items():
+                for hypostasis in by_id[remote_id]:
+                    hypostasis.non_empty_instance = instance
+        return hypostases
+
     def handle_as_new(self, group_dict=None):
         remote_instance = self.non_empty_instance
         last_name = remote_instance.last_name
@@ -157,22 +217,78 @@ class Group(models.Model):
     inconsistent = models.BooleanField(default=False)
     birth_date = models.DateField(null=True)
     person = models.ForeignKey(Person, null=True, on_delete=models.CASCADE)
+    # Time of the last change of records or inconsistency flag. Used by incremental merge.
+    modified = models.DateTimeField(auto_now=True, null=True, db_index=True)
+
+    @staticmethod
+    def touch(groups):
+        """Mark groups as modified in memory and in the database by one UPDATE query"""
+        groups = [group for group in groups if group is not None]
+        if groups:
+            now = timezone.now()
+            for group in groups:
+                group.modified = now
+            Group.objects.filter(id__in=[group.id for group in groups]).update(modified=now)
+
+    @staticmethod
+    def get_dictionary(groups=None):
+        """Dictionary of groups and lists of their records, made with two queries.
+
+        Pass groups (iterable or queryset) to load only them, otherwise all groups are loaded.
+        Records are ordered by id and reference group instances from the dictionary keys.
+        """
+        if groups is None:
+            groups = list(Group.objects.all())
+            records = GroupRecord.objects.filter(group__isnull=False)
+        else:
+            groups = list(groups)
+            records = GroupRecord.objects.filter(group_id__in=[group.id for group in groups])
+        group_dict = {group: [] for group in groups}
+        groups_by_id = {group.id: group for group in groups}
+        for record in records.order_by('id'):
+            group = groups_by_id[record.group_id]
+            record.group = group
+            group_dict[group].append(record)
+        return group_dict
+
+    @staticmethod
+    def get_index(key_functions=DEFAULT_BLOCKING_KEYS, groups=None):
+        """Dictionary of groups with an index for seek_for_group. Build once and pass as group_dict."""
+        return GroupIndex(Group.get_dictionary(groups), key_functions=key_functions)
 
     @staticmethod
-    def get_dictionary():
-        return {group: list(group.grouprecord_set.all()) for group in Group.objects.all()}
+    def get_inconsistent_ids(groups=None):
+        """Ids of chosen groups (all by default) with records differing in names or birth date.
+
+        Same as completely_equal_for_consistency for all records, but made by one aggregated query.
+        Counts of distinct values ignore nulls, so a column is also inconsistent if it is null only in some records.
+        """
+        if groups is None:
+            records = GroupRecord.objects.filter(group__isnull=False)
+        else:
+            records = GroupRecord.objects.filter(group_id__in=[group.id for group in groups])
+        attributes = ['last_name', 'first_name', 'middle_name', 'birth_date']
+        aggregates = {'total': Count('id')}
+        for attribute in attributes:
+            aggregates[attribute + '_distinct'] = Count(attribute, distinct=True)
+            aggregates[attribute + '_filled'] = Count(attribute)
+        inconsistent_ids = set()
+        for row in records.order_by().values('group_id').annotate(**aggregates):
+            for attribute in attributes:
+                filled = row[attribute + '_filled']
+                if row[attribute + '_distinct'] > 1 or 0 < filled < row['total']:
+                    inconsistent_ids.add(row['group_id'])
+                    break
+        return inconsistent_ids
 
     def update_consistency(self):
+        """Recompute inconsistency flag and save the group, so it is marked as modified"""
         records = list(self.grouprecord_set.all())
         if len(records) > 1:
             first = records.pop(0)
-            for record in records:
-                if not first.completely_equal_for_consistency(another_record=record):
-                    self.inconsistent = True
-                    self.save()
-                    return
-            self.inconsistent = False
-            self.save()
+            self.inconsistent = not all(first.completely_equal_for_consistency(another_record=record)
+                                        for record in records)
+        self.save()
 
     @property
     def is_merged(self):
@@ -184,33 +300,45 @@ class Group(models.Model):
                     return False
             return True
 
+    @transaction.atomic
     def unmake(self, search=True, group_dict=None, **kwargs):
-        """Split all records in this group and delete it. Can't be done for partially merged groups."""
+        """Split all records in this group and delete it. Can't be done for partially merged groups.
+
+        Pass ForbiddenRelations as "forbidden" keyword to reuse it, it is updated with new prohibitions.
+        """
         if self.person is not None:
             raise GroupError("Can't split group, if its part was previously merged")
         records = list(self.grouprecord_set.all()) if not group_dict else group_dict[self]
+        forbidden = kwargs.get('forbidden', None)
         for rec1, rec2 in combinations(records, 2):
             rec1.forbidden_group_records.add(rec2)
             rec2.forbidden_group_records.add(rec1)
+            if forbidden is not None:
+                forbidden.forbid_records(rec1, rec2)
         if group_dict:
             group_dict.pop(self)
         if search:
             if group_dict is None:
-                group_dict = Group.get_dictionary()
+                group_dict = Group.get_index()
+            if forbidden is None:
+                kwargs['forbidden'] = GroupRecord.get_forbidden_relations()
             for record in records:
                 record.group = None
                 new_group = record.seek_for_group(group_dict=group_dict, **kwargs)
                 if new_group:
                     record.group = new_group
+                    add_record_to_group_dict(group_dict, new_group, record)
                 else:
-                    new_group = record.seek_to_make_new_group(**kwargs)
+                    new_group = record.seek_to_make_new_group(group_dict=group_dict, **kwargs)
                     if new_group:
                         record.group = new_group
-                if new_group:
-                    group_dict[new_group].append(record)
+        GroupRecord.touch(records)
         bulk_update(records)
+        # Groups, which got records, changed too
+        Group.touch({record.group for record in records if record.group is not None})
         self.delete()
 
+    @transaction.atomic
     def merge(self):
         """Unite all records in this group so they and their related hypostases reference one person."""
         records = list(self.grouprecord_set.all())
@@ -225,48 +353,53 @@ class Group(models.Model):
             self.save()
 
 
-class GroupRecord(models.Model):
-    """ Records for pre-merge groups
+class RecordPredicatesMixin:
+    """Predicates, comparison and search methods of records shared by GroupRecord and CompactRecord.
 
-    Records reference group they belong to.
-    No reference to group means either absence of search or no matching records with this one.
-    Record may belong to up to one group.
-    Created groups may be joined, but neither groups nor records will be deleted in this process.
-    To merge records in group is to make them reference the same person, same for their hypostases.
-    Record must duplicate data in related hypostasis (reference to person) and its remote instance (other fields).
+    They use only fields copied by CompactRecord. Relations are queried only if ForbiddenRelations are not passed,
+    which works only for models.
+    Records of both classes are equal if they have the same id.
     """
-    hypostasis = models.ForeignKey(Hypostasis, on_delete=models.CASCADE)
-    person = models.ForeignKey(Person, null=True, on_delete=models.SET_NULL)
-    group = models.ForeignKey(Group, null=True, on_delete=models.SET_NULL)
-    last_name = models.CharField(max_length=255, null=True)
-    first_name = models.CharField(max_length=255, null=True)
-    middle_name = models.CharField(max_length=255, null=True)
-    birth_date = models.DateField(null=True)
-    forbidden_groups = models.ManyToManyField(Group, related_name='forbidden_group_record_set')
-    forbidden_group_records = models.ManyToManyField("self")
-    instance_type = models.CharField(max_length=255, default="")
-    # Set of method names, shared among instances. Used in _call_predicate as a cache.
-    __predicate_methods = set()
+    __slots__ = ()
+    # Classes, tuples of predicate method names and their functions. Used as a cache.
+    __predicate_functions = {}
+
+    def __eq__(self, other):
+        if not isinstance(other, RecordPredicatesMixin):
+            return NotImplemented
+        if self.id is None:
+            return self is other
+        return self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
 
     def __str__(self):
         return "{0} {1} {2} {3}".format(self.last_name, self.first_name, self.middle_name, self.birth_date)
 
+    @classmethod
+    def _get_predicate_functions(cls, predicate_methods):
+        """Functions of predicate methods with chosen names. Decorate with @predicate to use method here."""
+        key = (cls, tuple(predicate_methods))
+        functions = cls.__predicate_functions.get(key, None)
+        if functions is None:
+            functions = get_predicate_functions(cls, key[1])
+            cls.__predicate_functions[key] = functions
+        return functions
+
+    @classmethod
+    def compile_predicates(cls, predicate_methods, **kwargs):
+        """Callable checking all predicates for a pair of records: compiled(record, another_record).
+
+        Use it in loops instead of check_predicates: names are resolved and keywords are bound only once.
+        """
+        kwargs.pop('predicate_methods', None)
+        kwargs.pop('another_record', None)
+        return CompiledPredicates(predicate_methods, cls._get_predicate_functions(predicate_methods), kwargs)
+
     def _call_predicate(self, method_name, **kwargs):
         """Executes method with chosen name if it is a predicate method. Decorate with @predicate to use method here."""
-        if method_name in self.__predicate_methods:
-            # Method name has been checked already.
-            return getattr(self, method_name)(**kwargs)
-        else:
-            names = [tup[0] for tup in getmembers(self, predicate=ismethod)]
-            if method_name not in names:
-                raise AttributeError("{} is not a method of GroupRecord".format(method_name))
-            else:
-                method = getattr(self, method_name)
-                if getattr(method, "_is_a_predicate_method", False):
-                    self.__predicate_methods.add(method_name)
-                    return method(**kwargs)
-                else:
-                    raise AttributeError("{} is not an allowed predicate method".format(method_name))
+        return self._get_predicate_functions((method_name,))[0](self, **kwargs)
 
     def _compare_attribute(self, another_record, attribute, another_attribute=None, empty_values_work=True):
         if another_attribute is None:
@@ -302,8 +435,8 @@ class GroupRecord(models.Model):
         predicate_methods = kwargs.get('predicate_methods', None)
         if predicate_methods is None:
             raise AttributeError('You must pass names of predicates as a keyword argument method_names (iterable)')
-        for predicate_name in predicate_methods:
-            if not self._call_predicate(predicate_name, **kwargs):
+        for function in self._get_predicate_functions(predicate_methods):
+            if not function(self, **kwargs):
                 return False
         return True
 
@@ -352,25 +485,27 @@ class GroupRecord(models.Model):
     @predicate
     def close_by_fuzzy_metric(self, *, another_record,  attribute, tolerance=None, **kwargs):
         """Checks that all attributes except chosen are equal and the chosen one is close enough"""
-        default_tolerance = 0.86
         attributes = ['last_name', 'first_name', 'middle_name']
         if attribute not in attributes:
             raise AttributeError('{} is a wrong attribute'.format(attribute))
         else:
             if tolerance is None:
-                tolerance = default_tolerance
+                tolerance = DEFAULT_TOLERANCE
             attributes.remove(attribute)
             if self._compare_attributes(another_record, attributes):
                 str1 = getattr(self, attribute)
                 str2 = getattr(another_record, attribute)
                 if str1 is None or str2 is None:
                     return True
-                elif (levenshtein_distance(str1, str2) == 1) or (jaro_winkler(str1, str2) > tolerance):
+                elif are_close(str1, str2, tolerance):
                     return True
             return False
 
     @predicate
-    def not_forbidden(self, *, another_record, **kwargs):
+    def not_forbidden(self, *, another_record, forbidden=None, **kwargs):
+        """Uses ForbiddenRelations passed as "forbidden" keyword or queries the database"""
+        if forbidden is not None:
+            return not forbidden.records_forbidden(self, another_record)
         return another_record not in self.forbidden_group_records.all()
 
     @predicate
@@ -390,7 +525,7 @@ class GroupRecord(models.Model):
     @predicate
     def satisfies_existing_group_condition(self, *, another_record, tolerance=None, **kwargs):
         if self.has_equal_date(another_record=another_record):
-            return self.satisfies_new_group_condition(another_recsord=another_record, tolerance=tolerance)
+            return self.satisfies_new_group_condition(another_record=another_record, tolerance=tolerance)
 
     def compare_with_list(self, record_list, **kwargs):
         """ Full check with all records in list. Intended for inconsistent groups."""
@@ -398,14 +533,17 @@ class GroupRecord(models.Model):
             raise AttributeError('Group record should not have a group yet')
         else:
             predicate_methods = kwargs.pop('predicate_methods', ['satisfies_new_group_condition', 'not_forbidden'])
+            matches = self.compile_predicates(predicate_methods, **kwargs)
             for record_to_compare in record_list:
-                if self.check_predicates(predicate_methods=predicate_methods, another_record=record_to_compare,
-                                         **kwargs):
+                if matches(self, record_to_compare):
                     return True
             return False
 
     def seek_for_group(self, group_dict, **kwargs):
-        """In group_dict key must be a group and value must be a list of records"""
+        """In group_dict key must be a group and value must be a list of records
+
+        If group_dict is a GroupIndex, only its candidate groups are checked.
+        """
 
         def filter_function(item):
             d1 = item.birth_date
@@ -413,9 +551,17 @@ class GroupRecord(models.Model):
             return d1 == d2 if (d1 is not None and d2 is not None) else True
 
         predicate_methods = kwargs.pop('predicate_methods', ['satisfies_new_group_condition', 'not_forbidden'])
-        filtered_keys = list(filter(filter_function, group_dict.keys()))
+        if isinstance(group_dict, GroupIndex):
+            filtered_keys = group_dict.candidates(self)
+        else:
+            filtered_keys = list(filter(filter_function, group_dict.keys()))
+        forbidden = kwargs.get('forbidden', None)
+        matches = self.compile_predicates(predicate_methods, **kwargs)
         for group in filtered_keys:
-            if group in self.forbidden_groups.all():
+            if forbidden is not None:
+                if forbidden.group_forbidden(self, group):
+                    continue
+            elif group in self.forbidden_groups.all():
                 continue
             if len(group_dict[group]) < 2:
                 raise GroupError("Group (id={}) with less than 2 records is incorrect".format(group.id))
@@ -423,11 +569,100 @@ class GroupRecord(models.Model):
                 if self.compare_with_list(record_list=group_dict[group], predicate_methods=predicate_methods, **kwargs):
                     return group
             else:
-                if self.check_predicates(predicate_methods=predicate_methods,
-                                         another_record=group_dict[group][0],
-                                         **kwargs):
+                if matches(self, group_dict[group][0]):
                     return group
 
+
+class GroupRecord(RecordPredicatesMixin, models.Model):
+    """ Records for pre-merge groups
+
+    Records reference group they belong to.
+    No reference to group means either absence of search or no matching records with this one.
+    Record may belong to up to one group.
+    Created groups may be joined, but neither groups nor records will be deleted in this process.
+    To merge records in group is to make them reference the same person, same for their hypostases.
+    Record must duplicate data in related hypostasis (reference to person) and its remote instance (other fields).
+    """
+    hypostasis = models.ForeignKey(Hypostasis, on_delete=models.CASCADE)
+    person = models.ForeignKey(Person, null=True, on_delete=models.SET_NULL)
+    group = models.ForeignKey(Group, null=True, on_delete=models.SET_NULL)
+    last_name = models.CharField(max_length=255, null=True)
+    first_name = models.CharField(max_length=255, null=True)
+    middle_name = models.CharField(max_length=255, null=True)
+    birth_date = models.DateField(null=True)
+    forbidden_groups = models.ManyToManyField(Group, related_name='forbidden_group_record_set')
+    forbidden_group_records = models.ManyToManyField("self")
+    instance_type = models.CharField(max_length=255, default="")
+    # Time of the last change of names, date, group or forbidden relations. Used by incremental merge.
+    modified = models.DateTimeField(auto_now=True, null=True, db_index=True)
+
+    @staticmethod
+    def birth_date_key(record, today=None):
+        """Records without birth date are handled together with records born today (the current date by default)"""
+        if record.birth_date is None:
+            return today or date.today()
+        return record.birth_date
+
+    @staticmethod
+    def iterate_by_birth_date(queryset=None, chunk_size=10000, compact=False):
+        """Lists of records with equal birth_date_key in order of birth date, records in lists are ordered by id.
+
+        Numbers of records per date are counted by the database, then records of consecutive dates are loaded
+        with .iterator() in chunks of about chunk_size records. So only one chunk is in memory at once,
+        a chunk is larger than chunk_size only if a single date has more records.
+        With compact=True CompactRecord instances are loaded instead of models.
+        """
+        if queryset is None:
+            queryset = GroupRecord.objects.all()
+        today = date.today()
+        counts = {}
+        for birth_date, number in queryset.order_by().values('birth_date').annotate(number=Count('id'))\
+                .values_list('birth_date', 'number'):
+            key = today if birth_date is None else birth_date
+            counts[key] = counts.get(key, 0) + number
+        chunk = []
+        chunk_records = 0
+        for key in sorted(counts):
+            chunk.append(key)
+            chunk_records += counts[key]
+            if chunk_records >= chunk_size:
+                yield from GroupRecord._load_birth_date_chunk(queryset, chunk, today, compact)
+                chunk = []
+                chunk_records = 0
+        if chunk:
+            yield from GroupRecord._load_birth_date_chunk(queryset, chunk, today, compact)
+
+    @staticmethod
+    def _load_birth_date_chunk(queryset, dates, today, compact=False):
+        """Date "today" must be the same as in counts, so records without birth date are loaded after midnight too"""
+        condition = Q(birth_date__in=dates)
+        if today in dates:
+            condition |= Q(birth_date__isnull=True)
+        buckets = {key: [] for key in dates}
+        queryset = queryset.filter(condition).order_by('id')
+        records = CompactRecord.load(queryset) if compact else queryset.iterator()
+        for record in records:
+            buckets[GroupRecord.birth_date_key(record, today)].append(record)
+        for key in dates:
+            bucket = buckets.pop(key)
+            if bucket:
+                yield bucket
+
+    @staticmethod
+    def touch(records):
+        """Mark records as modified. auto_now works only with save, so call it before bulk_update with "modified"."""
+        now = timezone.now()
+        for record in records:
+            record.modified = now
+
+    @staticmethod
+    def get_forbidden_relations():
+        """Forbidden records and groups of all records, loaded with two queries"""
+        record_pairs = GroupRecord.forbidden_group_records.through.objects.values_list('from_grouprecord_id',
+                                                                                       'to_grouprecord_id')
+        group_pairs = GroupRecord.forbidden_groups.through.objects.values_list('grouprecord_id', 'group_id')
+        return ForbiddenRelations(record_pairs=record_pairs, group_pairs=group_pairs)
+
     def seek_for_group_and_save(self, group_dict, **kwargs):
         """In mass updates use bulk update instead"""
         predicate_methods = kwargs.get('predicate_methods', ['satisfies_new_group_condition', 'not_forbidden'])
@@ -437,28 +672,31 @@ class GroupRecord(models.Model):
                 group_dict[self.group].remove(self)
             self.group = suitable_group
             self.save()
-            group_dict[suitable_group].append(self)
+            add_record_to_group_dict(group_dict, suitable_group, self)
             return suitable_group
 
     def seek_to_make_new_group(self, group_dict=None, **kwargs):
         """Seek for record to merge. Make a new group if record exists. Return the new Group or None"""
         predicate_methods = kwargs.pop('predicate_methods',
                                        ['has_equal_date', 'satisfies_new_group_condition', 'not_forbidden'])
-        group = None
-        for record in GroupRecord.objects.filter(group__isnull=True):
-            if self.check_predicates(predicate_methods=predicate_methods, another_record=record, **kwargs) \
-                            and record != self:
-                if not group:
-                    group = Group(birth_date=self.birth_date)
-                    group.save()
-                    self.group = group
-                    self.save()
-                    if group_dict:
-                        group_dict[group] = [self]
+        matches = self.compile_predicates(predicate_methods, **kwargs)
+        matching_records = [record for record in GroupRecord.objects.filter(group__isnull=True)
+                            if matches(self, record) and record != self]
+        if len(matching_records) == 0:
+            return None
+        with transaction.atomic(savepoint=False):
+            group = Group(birth_date=self.birth_date)
+            group.save()
+            self.group = group
+            self.save()
+            for record in matching_records:
                 record.group = group
-                record.save()
-                if group_dict:
-                    group_dict[group].append(record)
+            GroupRecord.touch(matching_records)
+            bulk_update(matching_records, update_fields=['group', 'modified'])
+        if group_dict is not None:
+            group_dict[group] = [self]
+            for record in matching_records:
+                add_record_to_group_dict(group_dict, group, record)
         return group
 
     def merge_records_by_hypostases(self, other_records, save=True):
@@ -467,7 +705,11 @@ class GroupRecord(models.Model):
         This record's person becomes the person referensed by other records and their related hypostases.
         All empty persons (not referenced by any hypostases) are removed.
         No checks about group being made assuming this checks were done more efficiently, when
-        this group was created."""
+        this group was created.
+        With save=False returned persons are only candidates for deletion: unlike merge_records_by_persons,
+        they are not checked for hypostases outside of other_records, so some of them may remain referenced.
+        Pass them to Person.delete_orphans after saving, it deletes only persons without hypostases.
+        """
         hypostases_for_update = []
         records_for_update = []
         persons_to_delete = set()
@@ -482,15 +724,12 @@ class GroupRecord(models.Model):
             records_for_update.append(record)
         if self.person in persons_to_delete:
             persons_to_delete.remove(self.person)
-        for person in list(persons_to_delete):
-            for hypostasis in person.hypostasis_set.all():
-                if hypostasis not in hypostases_for_update:
-                    persons_to_delete.remove(person)
         if save:
-            bulk_update(records_for_update, update_fields=['person'])
-            bulk_update(hypostases_for_update, update_fields=['person'])
-            for person in persons_to_delete:
-                person.delete()
+            with transaction.atomic():
+                with WriteBuffer() as write_buffer:
+                    write_buffer.update(records_for_update, update_fields=['person'])
+                    write_buffer.update(hypostases_for_update, update_fields=['person'])
+                Person.delete_orphans(persons_to_delete)
         else:
             return records_for_update, hypostases_for_update, persons_to_delete
 
@@ -514,57 +753,279 @@ class GroupRecord(models.Model):
         for hypostasis in hypostases_for_update:
             hypostasis.person = new_person
         if save:
-            bulk_update(hypostases_for_update, update_fields=['person'])
-            bulk_update(records_for_update, update_fields=['person', 'group'])
-            for person in persons_to_delete:
-                person.delete()
+            with transaction.atomic():
+                with WriteBuffer() as write_buffer:
+                    write_buffer.update(hypostases_for_update, update_fields=['person'])
+                    write_buffer.update(records_for_update, update_fields=['person', 'group'])
+                Person.delete_orphans(persons_to_delete)
         else:
             return records_for_update, hypostases_for_update, persons_to_delete
 
-    def remove_from_group(self, search=True, group_dict=None):
-        """Add group to the forbidden and check for new groups"""
+    @transaction.atomic
+    def remove_from_group(self, search=True, group_dict=None, forbidden=None):
+        """Add group to the forbidden and check for new groups. Passed ForbiddenRelations are updated."""
         if self.group is not None:
             if self.group.grouprecord_set.count() == 2:
                 raise GroupError("Group can't contain less than 2 records. Delete the whole group instead.")
             if self.person == self.group.person:
                 raise GroupError("Can't remove merged person from group")
             if search and group_dict is None:
-                group_dict = Group.get_dictionary()
+                group_dict = Group.get_index()
             self.forbidden_groups.add(self.group)
             forbidden_group = self.group
+            if forbidden is not None:
+                forbidden.forbid_group(self, forbidden_group)
             self.group = None
             self.save()
             if forbidden_group.inconsistent:
                 forbidden_group.update_consistency()
+            else:
+                Group.touch([forbidden_group])
             if search:
                 group_dict[forbidden_group].remove(self)
-                new_group = self.seek_for_group_and_save(group_dict)
+                if forbidden is None:
+                    forbidden = GroupRecord.get_forbidden_relations()
+                new_group = self.seek_for_group_and_save(group_dict, forbidden=forbidden)
                 if new_group:
                     new_group.update_consistency()
                 else:
                     new_group = self.seek_to_make_new_group(
-                        predicate_methods=['has_equal_date', 'satisfies_new_group_condition', 'not_forbidden'])
+                        predicate_methods=['has_equal_date', 'satisfies_new_group_condition', 'not_forbidden'],
+                        group_dict=group_dict, forbidden=forbidden)
                     if new_group:
                         new_group.update_consistency()
 
-    def remove_record_from_forbidden(self, another_record):
+    def remove_record_from_forbidden(self, another_record, forbidden=None):
         """Remove another record from this record's forbidden records list and vice versa"""
         if not isinstance(another_record, GroupRecord):
             raise TypeError('{} is not a GroupRecord instance'.format(another_record))
         if another_record in self.forbidden_group_records.all():
             self.forbidden_group_records.remove(another_record)
             another_record.forbidden_group_records.remove(self)
+            if forbidden is not None:
+                forbidden.allow_records(self, another_record)
             self.save()
             another_record.save()
         else:
             raise AttributeError('GroupRecord {} is not forbidden for this record'.format(another_record))
 
-    def remove_group_from_forbidden(self, group):
+    def remove_group_from_forbidden(self, group, forbidden=None):
         """Remove group from this record's restricted groups list"""
         if not isinstance(group, Group):
             raise AttributeError('{} is not a Group instance'.format(group))
         if group in self.forbidden_groups.all():
             self.forbidden_groups.remove(group)
+            if forbidden is not None:
+                forbidden.allow_group(self, group)
             self.save()
         else:
             raise AttributeError('The group is not forbidden for this record')
+
+
+class CompactRecord(RecordPredicatesMixin):
+    """Light copy of GroupRecord fields used in matching, several times smaller than a model instance.
+
+    Predicates and search methods are shared with GroupRecord by RecordPredicatesMixin.
+    Relations are not loaded, so pass ForbiddenRelations as "forbidden" keyword to them.
+    Load with CompactRecord.load and write back only changed rows with as_model and bulk_update.
+    Assign a group through "group" attribute, as with models.
+    """
+    FIELDS = ('id', 'group_id', 'person_id', 'hypostasis_id', 'last_name', 'first_name', 'middle_name', 'birth_date',
+              'instance_type', 'modified')
+    __slots__ = FIELDS + ('_group',)
+
+    def __init__(self, id, group_id, person_id, hypostasis_id, last_name, first_name, middle_name, birth_date,
+                 instance_type, modified):
+        self.id = id
+        self.group_id = group_id
+        self.person_id = person_id
+        self.hypostasis_id = hypostasis_id
+        self.last_name = last_name
+        self.first_name = first_name
+        self.middle_name = middle_name
+        self.birth_date = birth_date
+        self.instance_type = instance_type
+        self.modified = modified
+        self._group = None
+
+    @staticmethod
+    def load(queryset):
+        """Iterator of compact records of GroupRecord queryset, made from values_list rows"""
+        for row in queryset.values_list(*CompactRecord.FIELDS).iterator():
+            yield CompactRecord(*row)
+
+    @property
+    def group(self):
+        """Group instance, if it was assigned, otherwise the group is loaded by group_id"""
+        if self._group is None and self.group_id is not None:
+            self._group = Group.objects.get(pk=self.group_id)
+        return self._group
+
+    @group.setter
+    def group(self, group):
+        self._group = group
+        self.group_id = None if group is None else group.id
+
+    @property
+    def pk(self):
+        return self.id
+
+    def as_model(self):
+        """Unsaved GroupRecord with the same field values, use it in bulk_update"""
+        return GroupRecord(id=self.id, group_id=self.group_id, person_id=self.person_id,
+                           hypostasis_id=self.hypostasis_id, last_name=self.last_name, first_name=self.first_name,
+                           middle_name=self.middle_name, birth_date=self.birth_date,
+                           instance_type=self.instance_type, modified=self.modified)
+
+    @staticmethod
+    def to_models(records):
+        """Models for bulk_update: compact records are converted, model instances are kept as they are"""
+        return [record.as_model() if isinstance(record, CompactRecord) else record for record in records]
+
+
+class MergeRun(models.Model):
+    """Run of main.merge.full_update. Start of the last finished run is a watermark for incremental runs."""
+    started = models.DateTimeField()
+    finished = models.DateTimeField(null=True)
+    incremental = models.BooleanField(default=False)
+
+    @staticmethod
+    def get_watermark():
+        """Start time of the last finished run or None, if there were no finished runs"""
+        last_run = MergeRun.objects.filter(finished__isnull=False).order_by('-started').first()
+        if last_run is None:
+            return None
+        return last_run.started
+
+
+class RemoteSnapshot(models.Model):
+    """Local copy of names and dates of remote students, employees and postgraduates.
+
+    Rows have attributes of remote instances used by merge utilities (names, date_birth, valid_from, valid_to),
+    so they may be used instead of remote instances. Keep it up to date with RemoteSnapshot.sync.
+    """
+    instance_type = models.CharField(max_length=255)
+    remote_id = models.CharField(max_length=255)
+    last_name = models.CharField(max_length=255, null=True)
+    first_name = models.CharField(max_length=255, null=True)
+    middle_name = models.CharField(max_length=255, null=True)
+    date_birth = models.DateField(null=True)
+    valid_from = models.DateField(null=True)
+    valid_to = models.DateField(null=True)
+    # Start of the last sync, which has fetched the instance
+    synced = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('instance_type', 'remote_id')
+
+    # For each instance type: remote model, its fields of validity dates (students keep them in history)
+    # and a filter of instances, which validity or history has started or ended since the date
+    REMOTE_MODELS = {
+        'student': (Student, None, None,
+                    lambda since: Q(history__activity_from__gte=since) | Q(history__activity_to__gte=since)),
+        'employee': (Employee, 'valid_from', 'valid_to',
+                     lambda since: Q(valid_from__gte=since) | Q(valid_to__gte=since)),
+        'postgraduate': (Postgraduate, 'enrollment', 'exclusion',
+                         lambda since: Q(enrollment__gte=since) | Q(exclusion__gte=since)),
+    }
+    SNAPSHOT_FIELDS = ['last_name', 'first_name', 'middle_name', 'date_birth', 'valid_from', 'valid_to', 'synced']
+
+    def __str__(self):
+        return "{0} {1}: {2} {3} {4}".format(self.instance_type, self.remote_id,
+                                             self.last_name, self.first_name, self.middle_name)
+
+    @staticmethod
+    def sync(instance_types=None, full=False, batch_size=1000):
+        """Copy remote instances to the snapshot. Returns number of fetched instances.
+
+        The first sync of an instance type and sync with full=True fetch all instances and delete rows of
+        instances, which were not found. Otherwise only instances with validity (student's history) started or
+        ended since the day of the previous sync are fetched. Other changes, like of names, need a full sync.
+        Instances of a type are fetched first, then they are written by batches, each in its own short transaction.
+        """
+        total = 0
+        for instance_type in instance_types or sorted(RemoteSnapshot.REMOTE_MODELS.keys()):
+            remote_model, valid_from, valid_to, changed_since = RemoteSnapshot.REMOTE_MODELS[instance_type]
+            started = timezone.now()
+            last_sync = RemoteSnapshot.objects.filter(instance_type=instance_type).aggregate(Max('synced'))
+            last_sync = last_sync['synced__max']
+            if full or last_sync is None:
+                print("Fetching all {}s".format(instance_type))
+                queryset = remote_model.objects.all()
+            else:
+                print("Fetching {}s changed since {}".format(instance_type, last_sync.date()))
+                queryset = remote_model.objects.filter(changed_since(last_sync.date()))
+            instances = OrderedDict((str(instance.pk), instance) for instance in queryset)
+            print("Storing {} {}s".format(len(instances), instance_type))
+            remote_ids = list(instances.keys())
+            for start in range(0, len(remote_ids), batch_size):
+                batch = OrderedDict((remote_id, instances[remote_id])
+                                    for remote_id in remote_ids[start:start + batch_size])
+                with transaction.atomic():
+                    total += RemoteSnapshot._store(instance_type, batch, valid_from, valid_to, started)
+            if full or last_sync is None:
+                RemoteSnapshot.objects.filter(instance_type=instance_type, synced__lt=started).delete()
+        print("Snapshot sync: {} instances fetched".format(total))
+        return total
+
+    @staticmethod
+    def _store(instance_type, instances, valid_from, valid_to, synced):
+        """Create or update rows for dictionary of remote ids and instances of one type"""
+        if len(instances) == 0:
+            return 0
+        existing = {row.remote_id: row for row in
+                    RemoteSnapshot.objects.filter(instance_type=instance_type, remote_id__in=list(instances.keys()))}
+        created = []
+        updated = []
+        for remote_id, instance in instances.items():
+            row = existing.get(remote_id, None)
+            if row is None:
+                row = RemoteSnapshot(instance_type=instance_type, remote_id=remote_id)
+                created.append(row)
+            else:
+                updated.append(row)
+            row.last_name = instance.last_name
+            row.first_name = instance.first_name
+            row.middle_name = instance.middle_name
+            row.date_birth = instance.date_birth
+            row.valid_from = getattr(instance, valid_from) if valid_from else None
+            row.valid_to = getattr(instance, valid_to) if valid_to else None
+            row.synced = synced
+        with WriteBuffer() as buffer:
+            buffer.create(RemoteSnapshot, created)
+            buffer.update(updated, RemoteSnapshot.SNAPSHOT_FIELDS)
+        return len(instances)
+
+    @staticmethod
+    def get_remote_ids(instance_type):
+        """Ids of all instances of the type in the snapshot, converted to the type of the remote primary key"""
+        to_python = RemoteSnapshot.REMOTE_MODELS[instance_type][0]._meta.pk.to_python
+        remote_ids = RemoteSnapshot.objects.filter(instance_type=instance_type).values_list('remote_id', flat=True)
+        return [to_python(remote_id) for remote_id in remote_ids]
+
+    @staticmethod
+    def get_instances(hypostases, fallback=True, batch_size=1000):
+        """List of snapshot rows for list of hypostases in the same order.
+
+        Instances missing in the snapshot are fetched from remote models in batches (see
+        Hypostasis.resolve_instances), if fallback is True, or are None otherwise.
+        """
+        hypostases = list(hypostases)
+        keys = [(hypostasis._instance_type, str(hypostasis.non_empty_id)) for hypostasis in hypostases]
+        ids_by_type = {}
+        for instance_type, remote_id in keys:
+            ids_by_type.setdefault(instance_type, []).append(remote_id)
+        rows = {}
+        for instance_type, remote_ids in ids_by_type.items():
+            for start in range(0, len(remote_ids), batch_size):
+                for row in RemoteSnapshot.objects.filter(instance_type=instance_type,
+                                                         remote_id__in=remote_ids[start:start + batch_size]):
+                    rows[(instance_type, row.remote_id)] = row
+        instances = [rows.get(key, None) for key in keys]
+        missing = [hypostasis for hypostasis, instance in zip(hypostases, instances) if instance is None]
+        if fallback and len(missing) > 0:
+            print("{} instances are not in the snapshot, fetching them".format(len(missing)))
+            Hypostasis.resolve_instances(missing)
+            instances = [hypostasis.non_empty_instance if instance is None else instance
+                         for hypostasis, instance in zip(hypostases, instances)]
+        return instances
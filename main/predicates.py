@@ -0,0 +1,32 @@
+def get_predicate_functions(cls, predicate_methods):
+    """Plain functions for names of class methods decorated with @predicate.
+
+    Functions are taken from the class without the decorator's wrapper, call them with an instance as first argument.
+    """
+    functions = []
+    for method_name in predicate_methods:
+        method = getattr(cls, method_name, None)
+        if method is None or not callable(method):
+            raise AttributeError("{} is not a method of {}".format(method_name, cls.__name__))
+        if not getattr(method, "_is_a_predicate_method", False):
+            raise AttributeError("{} is not an allowed predicate method".format(method_name))
+        functions.append(getattr(method, "__wrapped__", method))
+    return functions
+
+
+class CompiledPredicates:
+    """Predicate functions with keyword arguments bound once. Call with two records to check all predicates."""
+
+    __slots__ = ['predicate_methods', 'functions', 'kwargs']
+
+    def __init__(self, predicate_methods, functions, kwargs):
+        self.predicate_methods = tuple(predicate_methods)
+        self.functions = tuple(functions)
+        self.kwargs = kwargs
+
+    def __call__(self, record, another_record):
+        kwargs = self.kwargs
+        for function in self.functions:
+            if not function(record, another_record=another_record, **kwargs):
+                return False
+        return True
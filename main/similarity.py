@@ -0,0 +1,128 @@
+from collections import Counter
+from functools import lru_cache
+from time import time
+import jellyfish
+from jellyfish import jaro_winkler, levenshtein_distance
+
+DEFAULT_TOLERANCE = 0.86
+# Number of string pairs remembered by are_close
+CACHE_SIZE = 2 ** 17
+# jellyfish falls back to its pure Python implementation, if the extension is not built
+PURE_PYTHON_JELLYFISH = not (hasattr(jellyfish, 'cjellyfish') or hasattr(jellyfish, '_rustyfish'))
+# Maximal Winkler's boost: 4 characters of common prefix with 0.1 scaling factor
+_MAX_PREFIX_BOOST = 0.4
+# Margin for rounding errors in comparison of the bound with tolerance
+_EPSILON = 1e-9
+
+
+def are_close(str1, str2, tolerance=DEFAULT_TOLERANCE):
+    """Strings differ in one edit or their Jaro-Winkler similarity is greater than tolerance
+
+    Results are memoized, both metrics are symmetrical, so the pair is ordered to share results of (a, b) and (b, a).
+    """
+    if str2 < str1:
+        str1, str2 = str2, str1
+    return _are_close(str1, str2, tolerance)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _are_close(str1, str2, tolerance):
+    return bounded_are_close(str1, str2, tolerance)
+
+
+def reference_are_close(str1, str2, tolerance=DEFAULT_TOLERANCE):
+    """Definition of are_close with full computation of both metrics"""
+    return levenshtein_distance(str1, str2) == 1 or jaro_winkler(str1, str2) > tolerance
+
+
+def bounded_are_close(str1, str2, tolerance=DEFAULT_TOLERANCE):
+    """Same result as reference_are_close, but metrics are computed only if the answer depends on them.
+
+    Edit distance is checked only for strings with lengths differing by one at most.
+    Jaro-Winkler similarity is computed only if its upper bound is greater than tolerance.
+    """
+    len1 = len(str1)
+    len2 = len(str2)
+    if -1 <= len1 - len2 <= 1 and one_edit_apart(str1, str2):
+        return True
+    if len1 > 0 and len2 > 0:
+        if jaro_winkler_bound(str1, str2, histogram=PURE_PYTHON_JELLYFISH) + _EPSILON <= tolerance:
+            return False
+    return jaro_winkler(str1, str2) > tolerance
+
+
+def within_one_edit(str1, str2):
+    """levenshtein_distance(str1, str2) == 1, stops at the first difference"""
+    len1 = len(str1)
+    len2 = len(str2)
+    if len1 > len2:
+        str1, str2, len1, len2 = str2, str1, len2, len1
+    if len2 - len1 > 1:
+        return False
+    i = 0
+    while i < len1 and str1[i] == str2[i]:
+        i += 1
+    if len1 == len2:
+        return i < len1 and str1[i + 1:] == str2[i + 1:]
+    return str1[i:] == str2[i + 1:]
+
+
+def _levenshtein_is_one(str1, str2):
+    return levenshtein_distance(str1, str2) == 1
+
+
+# Compiled full distance is faster than the early exit loop in Python
+one_edit_apart = within_one_edit if PURE_PYTHON_JELLYFISH else _levenshtein_is_one
+
+
+def jaro_winkler_bound(str1, str2, histogram=False):
+    """Upper bound of Jaro-Winkler similarity of non-empty strings.
+
+    All characters of the shorter string are supposed to match without transpositions with maximal prefix boost.
+    With histogram=True number of matches is bounded by numbers of common characters instead.
+    """
+    len1 = len(str1)
+    len2 = len(str2)
+    if histogram:
+        counts = Counter(str1)
+        matches = sum(min(number, counts[character]) for character, number in Counter(str2).items())
+        if matches == 0:
+            return 0.0
+    else:
+        matches = min(len1, len2)
+    jaro = (matches / len1 + matches / len2 + 1) / 3
+    return jaro + _MAX_PREFIX_BOOST * (1 - jaro)
+
+
+def benchmark(pairs, tolerance=DEFAULT_TOLERANCE, number=5):
+    """Print time of reference_are_close and bounded_are_close for list of string pairs (without memo).
+
+    Raises AssertionError, if results differ.
+    """
+    pairs = list(pairs)
+    results = {}
+    for function in [reference_are_close, bounded_are_close]:
+        start = time()
+        for _ in range(number):
+            result = [function(str1, str2, tolerance) for str1, str2 in pairs]
+        elapsed = time() - start
+        results[function.__name__] = result
+        print("{0}: {1:.3f} seconds for {2} pairs".format(function.__name__, elapsed, len(pairs) * number))
+    assert results['reference_are_close'] == results['bounded_are_close'], "Bounded comparison gave other results"
+
+
+def cache_info():
+    """Hits, misses, maxsize and currsize of are_close memo"""
+    return _are_close.cache_info()
+
+
+def clear_cache():
+    _are_close.cache_clear()
+
+
+def report_cache():
+    info = cache_info()
+    total = info.hits + info.misses
+    if total > 0:
+        print("Fuzzy comparisons: {0} hits, {1} misses ({2:.1%} hit rate), {3} pairs cached".format(
+            info.hits, info.misses, info.hits / total, info.currsize))
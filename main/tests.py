@@ -1,3 +1,257 @@
-from django.test import TestCase
+import random
+from collections import OrderedDict
+from datetime import date
+from itertools import combinations
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from jellyfish import jaro_winkler
+
+from main.blocking import BlockingIndex, GroupIndex, DEFAULT_BLOCKING_KEYS
+from main.disjoint_set import DisjointSet
+from main.forbidden import ForbiddenRelations
+from main.models import CompactRecord, Group, GroupRecord, Hypostasis, Person
+from main.similarity import are_close, bounded_are_close, cache_info, clear_cache, jaro_winkler_bound, \
+    reference_are_close
+from main.vectorized import VectorizedPredicates
+
+LAST_NAMES = ['Ivanov', 'Ivanova', 'Ivonov', 'Petrov', 'Petrova', 'Sidorov', '', None]
+FIRST_NAMES = ['Ivan', 'Iwan', 'Petr', 'Pyotr', 'Anna', '', None]
+MIDDLE_NAMES = ['Ivanovich', 'Ivanovitch', 'Petrovich', 'Petrovna', '', None]
+INSTANCE_TYPES = ['student', 'employee', 'postgraduate']
+BIRTH_DATES = [date(1990, 1, 1), date(1990, 1, 2), None]
+
+
+def make_record(id, last_name, first_name, middle_name, birth_date=None, instance_type='student', group_id=None):
+    return CompactRecord(id, group_id, None, None, last_name, first_name, middle_name, birth_date, instance_type,
+                         None)
+
+
+def random_records(number, seed=0, birth_dates=BIRTH_DATES):
+    """Records with names from short lists, so many of them match each other"""
+    rnd = random.Random(seed)
+    return [make_record(id, rnd.choice(LAST_NAMES), rnd.choice(FIRST_NAMES), rnd.choice(MIDDLE_NAMES),
+                        rnd.choice(birth_dates), rnd.choice(INSTANCE_TYPES))
+            for id in range(1, number + 1)]
+
+
+def random_groups(number, seed=0):
+    """OrderedDict of unsaved groups and lists of 2 or 3 records with the group's birth date, some are inconsistent"""
+    rnd = random.Random(seed)
+    group_dict = OrderedDict()
+    record_id = 1000
+    for group_id in range(1, number + 1):
+        group = Group(id=group_id, birth_date=rnd.choice(BIRTH_DATES), inconsistent=rnd.random() < 0.3)
+        records = []
+        for _ in range(rnd.choice([2, 3])):
+            record_id += 1
+            records.append(make_record(record_id, rnd.choice(LAST_NAMES), rnd.choice(FIRST_NAMES),
+                                       rnd.choice(MIDDLE_NAMES), group.birth_date, rnd.choice(INSTANCE_TYPES),
+                                       group_id))
+        group_dict[group] = records
+    return group_dict
+
+
+def brute_force_positions(records, matches):
+    return [(i, j) for i, j in combinations(range(len(records)), 2) if matches(records[i], records[j])]
+
+
+class BlockingIndexTest(SimpleTestCase):
+    def test_default_keys_keep_all_matching_pairs(self):
+        matches = GroupRecord.compile_predicates(['satisfies_new_group_condition', 'not_forbidden'],
+                                                 forbidden=ForbiddenRelations())
+        for seed in range(5):
+            records = random_records(60, seed=seed, birth_dates=[None])
+            expected = brute_force_positions(records, matches)
+            self.assertTrue(expected)
+            candidates = BlockingIndex(records, DEFAULT_BLOCKING_KEYS).candidate_positions()
+            self.assertLess(len(candidates), len(records) * (len(records) - 1) // 2)
+            self.assertEqual([(i, j) for i, j in candidates if matches(records[i], records[j])], expected)
+
+    def test_unblocked_records_are_compared_with_all(self):
+        records = [make_record(1, 'Ivanov', 'Ivan', 'Ivanovich'), make_record(2, 'Petrov', 'Petr', 'Petrovich'),
+                   make_record(3, 'Sidorov', None, 'Petrovich'), make_record(4, 'Ivanov', 'Ivan', 'Petrovich')]
+        index = BlockingIndex(records, DEFAULT_BLOCKING_KEYS)
+        self.assertEqual(index.candidate_positions(), [(0, 2), (0, 3), (1, 2), (2, 3)])
+        self.assertEqual(index.block_sizes()[None], 1)
+
+    def test_without_key_functions_all_pairs_are_candidates(self):
+        records = random_records(10)
+        self.assertEqual(BlockingIndex(records, []).candidate_positions(), list(combinations(range(10), 2)))
+
+
+class DisjointSetTest(SimpleTestCase):
+    def test_components(self):
+        disjoint_set = DisjointSet(range(8))
+        disjoint_set.union(5, 1)
+        disjoint_set.union(1, 3)
+        disjoint_set.union(6, 7)
+        self.assertEqual(disjoint_set.components(), [[0], [1, 3, 5], [2], [4], [6, 7]])
+        self.assertEqual(disjoint_set.components(min_size=2), [[1, 3, 5], [6, 7]])
+        self.assertTrue(disjoint_set.connected(3, 5))
+        self.assertFalse(disjoint_set.connected(3, 6))
+
+    def test_components_do_not_depend_on_order_of_unions(self):
+        pairs = [(1, 2), (3, 4), (2, 3), (7, 8), (5, 5), (9, 7)]
+        expected = None
+        for seed in range(10):
+            random.Random(seed).shuffle(pairs)
+            disjoint_set = DisjointSet(range(10))
+            for a, b in pairs:
+                disjoint_set.union(a, b)
+            if expected is None:
+                expected = disjoint_set.components()
+            self.assertEqual(disjoint_set.components(), expected)
+        self.assertEqual(expected, [[0], [1, 2, 3, 4], [5], [6], [7, 8, 9]])
+
+    def test_unknown_elements_are_added(self):
+        disjoint_set = DisjointSet()
+        disjoint_set.union('a', 'b')
+        self.assertIn('a', disjoint_set)
+        self.assertEqual(len(disjoint_set), 2)
+        self.assertEqual(disjoint_set.find('c'), 'c')
+        self.assertEqual(len(disjoint_set), 3)
+
+
+class GroupIndexTest(SimpleTestCase):
+    def test_seek_for_group_finds_the_same_groups_as_without_index(self):
+        forbidden = ForbiddenRelations()
+        for seed in range(3):
+            group_dict = random_groups(40, seed=seed)
+            index = GroupIndex(group_dict)
+            found = 0
+            for record in random_records(80, seed=seed + 100):
+                expected = record.seek_for_group(group_dict, forbidden=forbidden)
+                self.assertEqual(record.seek_for_group(index, forbidden=forbidden), expected)
+                found += expected is not None
+            self.assertTrue(found)
+
+    def test_candidates_include_all_matching_groups(self):
+        matches = GroupRecord.compile_predicates(['satisfies_new_group_condition'])
+        group_dict = random_groups(40)
+        index = GroupIndex(group_dict)
+        for record in random_records(80, seed=1):
+            candidates = index.candidates(record)
+            self.assertEqual(candidates, sorted(candidates, key=list(group_dict.keys()).index))
+            for group, records in group_dict.items():
+                same_date = record.birth_date is None or group.birth_date in (None, record.birth_date)
+                if same_date and any(matches(record, group_record) for group_record in records):
+                    self.assertIn(group, candidates)
+
+    def test_added_records_and_groups_are_indexed(self):
+        group = Group(id=1, birth_date=date(1990, 1, 1))
+        index = GroupIndex({group: [make_record(1, 'Ivanov', 'Ivan', 'Ivanovich', date(1990, 1, 1))]})
+        record = make_record(2, 'Petrov', 'Petr', 'Petrovich', date(1990, 1, 1))
+        self.assertEqual(index.candidates(record), [])
+        index.add_record(group, make_record(3, 'Petrov', 'Petr', 'Petrovna', date(1990, 1, 1)))
+        self.assertEqual(index.candidates(record), [group])
+        new_group = Group(id=2, birth_date=None)
+        index.add_record(new_group, make_record(4, 'Petrova', 'Petr', 'Petrovich'))
+        self.assertEqual(index.candidates(record), [group, new_group])
+        index.pop(group)
+        self.assertEqual(index.candidates(record), [new_group])
+
+
+class VectorizedPredicatesTest(SimpleTestCase):
+    PREDICATE_LISTS = [
+        (['satisfies_new_group_condition', 'not_forbidden'], {}),
+        (['has_equal_date', 'satisfies_new_group_condition', 'not_forbidden'], {'tolerance': 0.9}),
+        (['completely_equal_for_search'], {}),
+        (['completely_equal_for_consistency'], {}),
+        (['has_equal_full_name'], {}),
+        (['has_equal_last_name', 'has_equal_first_and_middle_name'], {}),
+        (['changed_name'], {}),
+        (['close_by_fuzzy_metric'], {'attribute': 'middle_name'}),
+        (['close_by_fuzzy_metric'], {'attribute': 'last_name', 'tolerance': 1}),
+    ]
+
+    def test_same_pairs_as_scalar_predicates(self):
+        records = random_records(70, seed=3)
+        forbidden = ForbiddenRelations(record_pairs=[(records[0].id, records[5].id), (records[5].id, records[0].id)])
+        for predicate_methods, kwargs in self.PREDICATE_LISTS:
+            kwargs = dict(kwargs, forbidden=forbidden)
+            matches = GroupRecord.compile_predicates(predicate_methods, **kwargs)
+            vectorized = VectorizedPredicates(predicate_methods, **kwargs)
+            with self.subTest(predicate_methods=predicate_methods, kwargs=kwargs):
+                self.assertEqual(vectorized.matching_positions(records), brute_force_positions(records, matches))
+
+    def test_chosen_positions(self):
+        records = random_records(30, seed=4)
+        positions = [(i, j) for i, j in combinations(range(len(records)), 2) if (i + j) % 3 == 0]
+        predicate_methods = ['satisfies_new_group_condition']
+        matches = GroupRecord.compile_predicates(predicate_methods)
+        vectorized = VectorizedPredicates(predicate_methods)
+        self.assertEqual(vectorized.matching_positions(records, positions),
+                         [(i, j) for i, j in positions if matches(records[i], records[j])])
+        self.assertEqual(vectorized.matching_positions(records, []), [])
+
+
+class SimilarityTest(SimpleTestCase):
+    TOLERANCES = [0.5, 0.8, 0.86, 0.9, 0.95, 1]
+
+    @staticmethod
+    def strings():
+        rnd = random.Random(0)
+        names = [name for name in LAST_NAMES + FIRST_NAMES + MIDDLE_NAMES if name is not None]
+        names += [''.join(rnd.choice('abc') for _ in range(rnd.randint(1, 6))) for _ in range(40)]
+        return sorted(set(names))
+
+    def test_bounded_are_close_is_reference_are_close(self):
+        strings = self.strings()
+        for tolerance in self.TOLERANCES:
+            for str1 in strings:
+                for str2 in strings:
+                    self.assertEqual(bounded_are_close(str1, str2, tolerance),
+                                     reference_are_close(str1, str2, tolerance), (str1, str2, tolerance))
+
+    def test_jaro_winkler_bound_is_upper_bound(self):
+        strings = [string for string in self.strings() if string]
+        for str1 in strings:
+            for str2 in strings:
+                similarity = jaro_winkler(str1, str2)
+                self.assertGreaterEqual(jaro_winkler_bound(str1, str2) + 1e-9, similarity, (str1, str2))
+                self.assertGreaterEqual(jaro_winkler_bound(str1, str2, histogram=True) + 1e-9, similarity,
+                                        (str1, str2))
+
+    def test_are_close_is_symmetric_and_memoized(self):
+        clear_cache()
+        strings = self.strings()
+        for str1, str2 in combinations(strings, 2):
+            expected = reference_are_close(str1, str2)
+            self.assertEqual(are_close(str1, str2), expected)
+            self.assertEqual(are_close(str2, str1), expected)
+        pairs = len(strings) * (len(strings) - 1) // 2
+        self.assertEqual(cache_info().misses, pairs)
+        self.assertEqual(cache_info().hits, pairs)
+
+
+class DeleteOrphansTest(TestCase):
+    def setUp(self):
+        self.persons = [Person.objects.create(last_name='Ivanov', first_name='Ivan', middle_name=str(i))
+                        for i in range(5)]
+        # The first two persons have hypostases, others are orphans
+        for student_id, person in enumerate(self.persons[:2]):
+            Hypostasis.objects.create(student_id=student_id, person=person)
+        # Group of the last orphan, its records reference other persons
+        self.group = Group.objects.create(person=self.persons[4])
+        self.records = []
+        for employee_id, person in enumerate([self.persons[0], self.persons[3], self.persons[1]]):
+            hypostasis = Hypostasis.objects.create(employee_id=str(employee_id))
+            self.records.append(GroupRecord.objects.create(hypostasis=hypostasis, person=person,
+                                                           group=self.group if employee_id != 1 else None))
+        GroupRecord.objects.update(modified=None)
+
+    def test_chosen_persons(self):
+        deleted, kept = Person.delete_orphans([self.persons[0], self.persons[3].id, self.persons[4], None])
+        self.assertEqual((deleted, kept), (2, 1))
+        self.assertEqual(set(Person.objects.values_list('id', flat=True)),
+                         {person.id for person in self.persons[:3]})
+        self.assertFalse(Group.objects.exists())
+        records = {record.id: record for record in GroupRecord.objects.all()}
+        self.assertIsNone(records[self.records[1].id].person)
+        for record in self.records:
+            self.assertIsNone(records[record.id].group)
+            self.assertIsNotNone(records[record.id].modified)
+
+    def test_all_persons(self):
+        self.assertEqual(Person.delete_orphans(batch_size=2), (3, 2))
+        self.assertEqual(Person.delete_orphans(), (0, 2))
@@ -1,4 +1,6 @@
-from main.models import Hypostasis, Person, Group, GroupRecord
+from main.models import Hypostasis, Person, Group, GroupRecord, RemoteSnapshot
+from main import similarity
+from main.bulk import queryset_chunks
 from main_remote.models import Student, Employee, Postgraduate
 from bulk_update.helper import bulk_update
 from crequest.middleware import CrequestMiddleware
@@ -8,33 +10,47 @@ from time import time
 import random
 
 
-def create_hypostases():
-    """Create a new hypostasis for each student, employee and postgraduate. Should be called once."""
-    print("\n\n\nStarted fetching students\n\n\n")
-    students_list = list(Student.objects.all())
-    print("\n\n\nStarted fetching employees\n\n\n")
-    employee_list = list(Employee.objects.all())
-    print("\n\n\nStarted fetching postgraduates\n\n\n")
-    postgraduate_list = list(Postgraduate.objects.all())
+def create_hypostases(use_snapshot=True):
+    """Create a new hypostasis for each student, employee and postgraduate. Should be called once.
+
+    With use_snapshot ids are taken from RemoteSnapshot after its sync instead of fetching full remote lists.
+    """
+    if use_snapshot:
+        RemoteSnapshot.sync()
+        student_ids = RemoteSnapshot.get_remote_ids('student')
+        employee_ids = RemoteSnapshot.get_remote_ids('employee')
+        postgraduate_ids = RemoteSnapshot.get_remote_ids('postgraduate')
+    else:
+        print("\n\n\nStarted fetching students\n\n\n")
+        student_ids = [student.id for student in Student.objects.all()]
+        print("\n\n\nStarted fetching employees\n\n\n")
+        employee_ids = [employee.id for employee in Employee.objects.all()]
+        print("\n\n\nStarted fetching postgraduates\n\n\n")
+        postgraduate_ids = [postgraduate.id for postgraduate in Postgraduate.objects.all()]
     print("\n\n\nMaking hypostases for students.\n\n\n")
     hypostases = []
-    for student in students_list:
-        hypostases.append(Hypostasis(student_id=student.id))
+    for student_id in student_ids:
+        hypostases.append(Hypostasis(student_id=student_id))
     print("\n\n\nMaking hypostases for employees.\n\n\n")
-    for employee in employee_list:
-        hypostases.append(Hypostasis(employee_id=employee.id))
+    for employee_id in employee_ids:
+        hypostases.append(Hypostasis(employee_id=employee_id))
     print("\n\n\nMaking hypostases for postgraduates.\n\n\n")
-    for postgraduate in postgraduate_list:
-        hypostases.append(Hypostasis(postgraduate_id=postgraduate.id))
+    for postgraduate_id in postgraduate_ids:
+        hypostases.append(Hypostasis(postgraduate_id=postgraduate_id))
     Hypostasis.objects.bulk_create(hypostases)
 
 
 def create_persons(hypo_list):
-    """Create a person for each hypostasis in list."""
+    """Create a person for each hypostasis in list. Names and dates are taken from RemoteSnapshot."""
     hypostases_to_update = []
+    hypo_list = list(hypo_list)
+    print("Reading snapshot")
+    instances = RemoteSnapshot.get_instances(hypo_list)
     print("Making")
-    for h in hypo_list:
-        instance = h.non_empty_instance
+    for h, instance in zip(hypo_list, instances):
+        if instance is None:
+            print("Remote instance of hypostasis {} is not found, skipped".format(h.id))
+            continue
         new_person = Person(last_name=instance.last_name,
                             first_name=instance.first_name,
                             middle_name=instance.middle_name,
@@ -76,16 +92,21 @@ def update_persons_in_groups():
 
 
 def create_group_records(no_doubles=False):
-    """Creates group records for initial data for test purposes."""
+    """Creates group records for initial data for test purposes. Names and dates are taken from RemoteSnapshot."""
     records = []
     print("\nCreating records\n")
+    hypostases = Hypostasis.objects.all()
+    if no_doubles:
+        hypostases = hypostases.filter(grouprecord__isnull=True)
+    hypostases = list(hypostases)
+    print("\nReading snapshot\n")
+    instances = RemoteSnapshot.get_instances(hypostases)
     i = 0
-    for hypo in list(Hypostasis.objects.all()):
-        if no_doubles:
-            if hypo.grouprecord_set.count() > 0:
-                continue
+    for hypo, instance in zip(hypostases, instances):
         print("{0}".format(i))
-        instance = hypo.non_empty_instance
+        if instance is None:
+            print("Remote instance of hypostasis {} is not found, skipped".format(hypo.id))
+            continue
         person = hypo.person
         records.append(GroupRecord(hypostasis=hypo,
                                    person=person,
@@ -103,14 +124,16 @@ def create_group_records(no_doubles=False):
 
 def update_group_record_persons():
     start = time()
-    grs = list(GroupRecord.objects.all())
-    for gr in grs:
-        print(gr.id)
-        gr.person = gr.hypostasis.person
-    update = time()
-    bulk_update(grs, update_fields=['person'], batch_size=1000)
-    print("{} seconds for update".format(update - start))
-    print("{} seconds for save".format(time() - update))
+    save_time = 0
+    for grs in queryset_chunks(GroupRecord.objects.select_related('hypostasis')):
+        for gr in grs:
+            gr.person_id = gr.hypostasis.person_id
+        print("{} records handled, last id {}".format(len(grs), grs[-1].id))
+        update = time()
+        bulk_update(grs, update_fields=['person'], batch_size=1000)
+        save_time += time() - update
+    print("{} seconds for update".format(time() - start - save_time))
+    print("{} seconds for save".format(save_time))
 
 
 def rand_str(length):
@@ -129,6 +152,7 @@ def random_records():
         r.last_name = rand_str(random.randint(2,30))
         r.first_name = rand_str(random.randint(2, 30))
         r.middle_name = rand_str(random.randint(2, 30))
+    GroupRecord.touch(lst)
     bulk_update(lst)
 
 
@@ -136,6 +160,7 @@ def drop_from_group():
     print("Droping one record from big groups")
     dct = Group.get_dictionary()
     records = []
+    groups = []
     i = 0
     ttl = len(dct)
     for v in dct.values():
@@ -143,10 +168,13 @@ def drop_from_group():
         if i % 100 == 0:
             print("{} of {}".format(i, ttl))
         if len(v) > 2:
+            groups.append(v[0].group)
             v[0].group = None
             records.append(v[0])
     print("Saving")
-    bulk_update(records, update_fields=['group'], batch_size=1000)
+    GroupRecord.touch(records)
+    bulk_update(records, update_fields=['group', 'modified'], batch_size=1000)
+    Group.touch(groups)
     print("Done")
 
 
@@ -182,10 +210,20 @@ def emps():
 def update_record_instance_type():
     """For records with no instance type - get one from hypostasis"""
     print("Filling records' instance type")
-    records = list(GroupRecord.objects.all())
-    for rec in records:
-        rec.instance_type = rec.hypostasis._instance_type
-    print("Saving")
-    bulk_update(records, update_fields=["instance_type"], batch_size=10000)
+    for records in queryset_chunks(GroupRecord.objects.select_related('hypostasis')):
+        for rec in records:
+            rec.instance_type = rec.hypostasis._instance_type
+        print("Saving {} records, last id {}".format(len(records), records[-1].id))
+        GroupRecord.touch(records)
+        bulk_update(records, update_fields=["instance_type", "modified"], batch_size=10000)
     print("Done")
 
+
+def benchmark_similarity(size=2000, attribute='last_name'):
+    """Compare full and bounded fuzzy comparisons on all pairs of random names from group records"""
+    print("Extracting names")
+    names = list(GroupRecord.objects.exclude(**{attribute + '__isnull': True})
+                 .values_list(attribute, flat=True).distinct())
+    names = random.sample(names, min(size, len(names)))
+    print("Comparing {} names".format(len(names)))
+    similarity.benchmark((name1, name2) for i, name1 in enumerate(names) for name2 in names[i + 1:])
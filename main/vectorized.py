@@ -0,0 +1,198 @@
+import numpy as np
+from main.models import GroupRecord
+from main.blocking import NAME_ATTRIBUTES
+from main.similarity import are_close, DEFAULT_TOLERANCE
+
+NONE_CODE = -1
+
+
+class Vocabulary:
+    """Dictionary encoding of strings to integer codes. None is encoded as NONE_CODE."""
+
+    def __init__(self):
+        self.codes = {}
+        self.words = []
+        self.empty_code = self.encode("")
+
+    def encode(self, value):
+        if value is None:
+            return NONE_CODE
+        code = self.codes.get(value, None)
+        if code is None:
+            code = len(self.words)
+            self.codes[value] = code
+            self.words.append(value)
+        return code
+
+    def decode(self, code):
+        return None if code == NONE_CODE else self.words[code]
+
+
+class RecordColumns:
+    """Names, instance types and birth dates of records as integer arrays"""
+
+    def __init__(self, records, vocabulary):
+        self.records = records
+        self.vocabulary = vocabulary
+        self.codes = {}
+        self.empty = {}
+        for attribute in NAME_ATTRIBUTES + ['instance_type']:
+            codes = np.fromiter((vocabulary.encode(getattr(record, attribute)) for record in records),
+                                dtype=np.int64, count=len(records))
+            self.codes[attribute] = codes
+            self.empty[attribute] = (codes == NONE_CODE) | (codes == vocabulary.empty_code)
+        self.codes['birth_date'] = np.fromiter(
+            (NONE_CODE if record.birth_date is None else record.birth_date.toordinal() for record in records),
+            dtype=np.int64, count=len(records))
+        self.empty['birth_date'] = self.codes['birth_date'] == NONE_CODE
+
+
+class VectorizedPredicates:
+    """Checks predicates for many pairs of records at once with the same results as GroupRecord.check_predicates.
+
+    Exact comparisons are made on arrays of codes. Strings are compared with fuzzy metric only for pairs, which
+    are not decided by exact comparisons. Predicates without vectorized form, as well as not_forbidden without
+    ForbiddenRelations, are checked per pair only for pairs, which passed previous predicates.
+    """
+
+    def __init__(self, predicate_methods, **kwargs):
+        kwargs.pop('predicate_methods', None)
+        self.predicate_methods = list(predicate_methods)
+        self.kwargs = kwargs
+        self.vocabulary = Vocabulary()
+        self._vectorized = {
+            'completely_equal_for_search': self._completely_equal_for_search,
+            'completely_equal_for_consistency': self._completely_equal_for_consistency,
+            'has_equal_full_name': self._has_equal_full_name,
+            'has_equal_last_name': lambda c, l, r: self._equal(c, 'last_name', l, r),
+            'has_equal_first_name': lambda c, l, r: self._equal(c, 'first_name', l, r),
+            'has_equal_middle_name': lambda c, l, r: self._equal(c, 'middle_name', l, r),
+            'has_equal_date': lambda c, l, r: self._equal(c, 'birth_date', l, r),
+            'has_equal_first_and_middle_name': self._has_equal_first_and_middle_name,
+            'has_equal_last_and_middle_name': self._has_equal_last_and_middle_name,
+            'changed_name': self._changed_name,
+            'satisfies_new_group_condition': self._satisfies_new_group_condition,
+        }
+        if 'attribute' in kwargs:
+            self._vectorized['close_by_fuzzy_metric'] = \
+                lambda c, l, r: self._close_by_fuzzy_metric(c, kwargs['attribute'], l, r)
+        if kwargs.get('forbidden', None) is not None:
+            self._vectorized['not_forbidden'] = self._not_forbidden
+
+    @property
+    def tolerance(self):
+        tolerance = self.kwargs.get('tolerance', None)
+        return DEFAULT_TOLERANCE if tolerance is None else tolerance
+
+    def matching_pairs(self, records, positions=None):
+        """Pairs of records satisfying all predicates.
+
+        positions is a list of (i, j) pairs of indexes in records, all pairs with i < j are checked by default.
+        """
+        return [(records[i], records[j]) for i, j in self.matching_positions(records, positions)]
+
+    def matching_positions(self, records, positions=None):
+        """Like matching_pairs, but gives (i, j) pairs of indexes in records"""
+        columns = RecordColumns(records, self.vocabulary)
+        if positions is None:
+            left, right = np.triu_indices(len(records), 1)
+        else:
+            pairs = np.array(positions, dtype=np.intp).reshape(-1, 2)
+            left, right = pairs[:, 0], pairs[:, 1]
+        mask = self.evaluate(columns, left, right)
+        return list(zip(left[mask].tolist(), right[mask].tolist()))
+
+    def evaluate(self, columns, left, right):
+        """Boolean array: all predicates are satisfied for records with indexes left[k] and right[k]"""
+        mask = np.ones(len(left), dtype=bool)
+        for method_name in self.predicate_methods:
+            survivors = np.flatnonzero(mask)
+            if len(survivors) == 0:
+                break
+            mask[survivors] = self._evaluate_one(method_name, columns, left[survivors], right[survivors])
+        return mask
+
+    def _evaluate_one(self, method_name, columns, left, right):
+        vectorized = self._vectorized.get(method_name, None)
+        if vectorized is not None:
+            return vectorized(columns, left, right)
+        matches = GroupRecord.compile_predicates([method_name], **self.kwargs)
+        records = columns.records
+        return np.fromiter((matches(records[i], records[j]) for i, j in zip(left.tolist(), right.tolist())),
+                           dtype=bool, count=len(left))
+
+    @staticmethod
+    def _equal(columns, attribute, left, right):
+        """Like GroupRecord._compare_attribute with empty_values_work=False"""
+        codes = columns.codes[attribute]
+        return codes[left] == codes[right]
+
+    def _equal_or_empty(self, columns, attribute, left, right):
+        """Like GroupRecord._compare_attribute with empty_values_work=True"""
+        empty = columns.empty[attribute]
+        return self._equal(columns, attribute, left, right) | empty[left] | empty[right]
+
+    def _completely_equal_for_search(self, columns, left, right):
+        result = self._has_equal_full_name(columns, left, right)
+        return result & self._equal_or_empty(columns, 'birth_date', left, right)
+
+    def _completely_equal_for_consistency(self, columns, left, right):
+        result = self._equal(columns, 'birth_date', left, right)
+        for attribute in NAME_ATTRIBUTES:
+            result &= self._equal(columns, attribute, left, right)
+        return result
+
+    def _has_equal_full_name(self, columns, left, right):
+        result = np.ones(len(left), dtype=bool)
+        for attribute in NAME_ATTRIBUTES:
+            result &= self._equal_or_empty(columns, attribute, left, right)
+        return result
+
+    def _has_equal_first_and_middle_name(self, columns, left, right):
+        return self._equal(columns, 'first_name', left, right) & self._equal(columns, 'middle_name', left, right)
+
+    def _has_equal_last_and_middle_name(self, columns, left, right):
+        return self._equal(columns, 'last_name', left, right) & self._equal(columns, 'middle_name', left, right)
+
+    def _changed_name(self, columns, left, right):
+        return ~self._equal(columns, 'instance_type', left, right) & \
+               (self._has_equal_first_and_middle_name(columns, left, right) |
+                self._has_equal_last_and_middle_name(columns, left, right))
+
+    def _close_by_fuzzy_metric(self, columns, attribute, left, right):
+        if attribute not in NAME_ATTRIBUTES:
+            raise AttributeError('{} is a wrong attribute'.format(attribute))
+        result = np.ones(len(left), dtype=bool)
+        for other in NAME_ATTRIBUTES:
+            if other != attribute:
+                result &= self._equal_or_empty(columns, other, left, right)
+        codes = columns.codes[attribute]
+        left_codes = codes[left]
+        right_codes = codes[right]
+        undecided = result & (left_codes != NONE_CODE) & (right_codes != NONE_CODE)
+        tolerance = self.tolerance
+        if tolerance < 1:
+            # Jaro-Winkler similarity of equal non-empty strings is 1
+            undecided &= (left_codes != right_codes) | (left_codes == self.vocabulary.empty_code)
+        indexes = np.flatnonzero(undecided)
+        decode = self.vocabulary.decode
+        result[indexes] = np.fromiter(
+            (are_close(decode(code1), decode(code2), tolerance)
+             for code1, code2 in zip(left_codes[indexes].tolist(), right_codes[indexes].tolist())),
+            dtype=bool, count=len(indexes))
+        return result
+
+    def _satisfies_new_group_condition(self, columns, left, right):
+        result = self._changed_name(columns, left, right)
+        for attribute in ['last_name', 'middle_name', 'first_name']:
+            rest = np.flatnonzero(~result)
+            if len(rest) == 0:
+                break
+            result[rest] = self._close_by_fuzzy_metric(columns, attribute, left[rest], right[rest])
+        return result
+
+    def _not_forbidden(self, columns, left, right):
+        forbidden = self.kwargs['forbidden']
+        records = columns.records
+        return np.fromiter((not forbidden.records_forbidden(records[i], records[j])
+                            for i, j in zip(left.tolist(), right.tolist())), dtype=bool, count=len(left))
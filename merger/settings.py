@@ -292,6 +292,25 @@ NSI_SERVER_URI = OverrideMe('http://127.0.0.1:31780')
 
 NSI_API_PATH = DoNotOverrideMe('/polyana-nsi-ws/nsi/api')
 
+# Maximal number of pages of NSI query results requested at once, 1 means one by one
+NSI_PAGING_CONCURRENCY = DoNotCare(4)
+
+# Seconds to keep settings of NSI and Core servers (page size and other limits) in the process memory
+REMOTE_SETTINGS_TTL = DoNotCare(600)
+# Maximal length of encoded NSI query, used to size batches of ids, if the server does not report it
+NSI_MAX_QUERY_LENGTH = DoNotCare(4000)
+
+# Pool of keep-alive connections to NSI, Core and LDAP proxy: connections per host, retries of failed connections,
+# backoff factor of retries and timeouts (seconds to connect, seconds to wait for a response)
+HTTP_POOL_SIZE = DoNotCare(10)
+HTTP_RETRIES = DoNotCare(3)
+HTTP_BACKOFF_FACTOR = DoNotCare(0.3)
+HTTP_TIMEOUT = DoNotCare((5, 60))
+# Asynchronous requests share one session per event loop: limit of its connections to all hosts
+# and maximal number of requests in progress (HTTP_POOL_SIZE of them per host)
+HTTP_ASYNC_LIMIT = DoNotCare(30)
+HTTP_ASYNC_CONCURRENCY = DoNotCare(10)
+
 LDAP_PROXY_SERVER_URI = OverrideMe('http://127.0.0.1:31780')
 
 LDAP_PROXY_API_PATH = DoNotOverrideMe('/polyana-ldap-proxy-ws/ldapproxy/api')
@@ -875,6 +894,13 @@ CAS_PENTAHO_SEC_CHECK = DoNotOverrideMe("j_spring_cas_security_check")
 
 XLSX_ROOT = DoNotOverrideMe(os.path.join(BASE_DIR, "xlsx_dumps/"))
 
+# ------------------ Merge settings ------------------
+
+# Number of processes for create_new_groups, 1 means no worker processes
+MERGE_WORKERS = DoNotCare(1)
+# Minimal number of records in a batch of date groups sent to a worker process
+MERGE_BATCH_SIZE = DoNotCare(2000)
+
 ########################################################################################################################
 # Overriding variables by local_settings.py
 ########################################################################################################################
@@ -2,9 +2,9 @@ import asyncio
 import json
 import logging
 from django.db.models.query_utils import Q
+from remote_impl.http_session import get_session
 from remote_impl.remote_database_exception import RemoteDatabaseError
 
-import requests
 from django.conf import settings
 from django_remote_model.serializers import DateTimeSerializer
 from django_remote_model.util.util import core_get_query_from_Q
@@ -90,8 +90,8 @@ class Core:
     # TODO: why not in impl???
     def post_modified_json_result(self, result, id, version, username, password):
         json_result = json.dumps(result)
-        r = requests.post(self.__server_uri + self.__api_path + "/jsonresult/data", json_result,
-                          headers={"content-type": "application/json; charset=utf8"}, auth=(username, password))
+        r = get_session().post(self.__server_uri + self.__api_path + "/jsonresult/data", json_result,
+                               headers={"content-type": "application/json; charset=utf8"}, auth=(username, password))
         return r.status_code
 
     def get_allowed_objects(self, model, permission, limit_low=None, limit_high=None,
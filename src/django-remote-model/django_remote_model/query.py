@@ -1,7 +1,11 @@
 import asyncio
 import logging
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from inspect import isclass
 
+from crequest.middleware import CrequestMiddleware
+from django.conf import settings
 from django.db import models
 from django.db.models import query
 from django.db.models.constants import LOOKUP_SEP
@@ -11,9 +15,10 @@ from django.db.models.query_utils import Q
 import django_remote_model
 import django_remote_model.models
 from core_client.queries import core
-from django_remote_model.util.util import nsi_get_query_from_Q
+from django_remote_model.util.util import nsi_get_query_from_Q, query_quote, format_query_value
 from ldap_proxy_client.queries import ldap_proxy
 from nsi_client.queries import nsi
+from nsi_client.queries_async import nsi_async
 from remote_impl.ldap_proxy import ldap_proxy_impl
 from remote_impl.nsi import nsi_impl
 from remote_impl.nsi_async import nsi_impl_async
@@ -573,6 +578,10 @@ class RemoteNSIQuerySet(RemoteQuerySet):
     _nsi_impl = nsi_impl
     _nsi = nsi
     _nsi_impl_async = nsi_impl_async
+    _nsi_async = nsi_async
+
+    # Number of ids in one "id IN" query of in_bulk
+    IN_BULK_BATCH_SIZE = 100
 
     def __init__(self, model=None, query=None):
         super().__init__(model, query or NSIQuery(model, self))
@@ -680,6 +689,63 @@ class RemoteNSIQuerySet(RemoteQuerySet):
 
         return None
 
+    def in_bulk(self, id_list, batch_size=None, concurrency=None):
+        """
+        Gets objects of the queryset by list of ids
+        Objects, which were requested by id recently, are taken from cache (for querysets without filters).
+        Others are requested by "id IN" queries of batch_size ids at most (by default IN_BULK_BATCH_SIZE or less
+        to fit in the maximal query length of server), no more than concurrency queries at once
+        (settings.NSI_PAGING_CONCURRENCY by default).
+        :return: dictionary of ids from id_list and found objects
+        """
+        id_list = list(OrderedDict.fromkeys(id_list))
+        if self.query.empty or len(id_list) == 0:
+            return {}
+        if batch_size is None:
+            batch_size = self._get_in_bulk_batch_size(id_list)
+        if concurrency is None:
+            concurrency = getattr(settings, "NSI_PAGING_CONCURRENCY", 1)
+        result = {}
+        if self.query.as_query_string() is None:
+            for id, obj in self._nsi.get_cached_objects_by_ids(self.model, id_list).items():
+                if not self._exclude(obj):
+                    result[id] = obj
+        # ids are compared as values of primary key, e.g. "1" and 1 for integer keys
+        to_python = self.model._meta.pk.to_python
+        missing = OrderedDict((to_python(id), id) for id in id_list if id not in result)
+        missing_ids = list(missing.keys())
+        batches = [missing_ids[i:i + batch_size] for i in range(0, len(missing_ids), batch_size)]
+        if concurrency <= 1 or len(batches) <= 1:
+            parts = map(self._get_batch_by_ids, batches)
+        else:
+            # Requests take authentication from the current request, which is stored per thread
+            request = CrequestMiddleware.get_request()
+
+            def get_batch(batch):
+                CrequestMiddleware.set_request(request)
+                return self._get_batch_by_ids(batch)
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                parts = list(executor.map(get_batch, batches))
+        for part in parts:
+            for obj in part:
+                id = missing.get(obj.pk, None)
+                if id is not None:
+                    result[id] = obj
+        return result
+
+    def _get_in_bulk_batch_size(self, ids):
+        """IN_BULK_BATCH_SIZE or less, so encoded list of ids fits in the maximal query length of server"""
+        id_length = max(len(query_quote(str(format_query_value(id)) + ",")) for id in ids)
+        return max(1, min(self.IN_BULK_BATCH_SIZE, self._nsi.get_max_query_length() // id_length))
+
+    def _get_batch_by_ids(self, ids):
+        query = self.filter(**{self.model._meta.pk.attname + LOOKUP_SEP + "in": ids}).query.as_query_string()
+        return [obj for obj in self._nsi.get_objects_with_paging(
+            self.model,
+            lambda page: self._nsi_impl.get_objects(self.model.url, query=query, page=page, model=self.model),
+            None, None, concurrency=1) if not self._exclude(obj)]
+
     def _try_to_find_m2m_in_query(self):
         for k, v in self.query.simple_filters().items():
             spl = k.split(LOOKUP_SEP, 1)
@@ -717,17 +783,24 @@ class RemoteNSIQuerySet(RemoteQuerySet):
             through_query = m2m_field.m2m_reverse_name() if direct else m2m_field.m2m_column_name()
             through_field = m2m_field.m2m_column_name() if direct else m2m_field.m2m_reverse_name()
             through_objects = through.objects.filter(**{through_query: rel_id})
-            if isinstance(through, django_remote_model.models.RemoteNSIModel):
+            if issubclass(through, django_remote_model.models.RemoteNSIModel):
                 through_objects = through_objects.filter(valid=True)
             result_set = set()
             result_idx = 0
+            rids = []
             for rid in (getattr(t, through_field) for t in through_objects):
                 if rid not in result_set:
                     if result_idx >= self.query.limit_low and\
                             (self.query.limit_high is None or result_idx < self.query.limit_high):
-                        yield self._nsi.get_object_by_id(self.model, rid)
+                        rids.append(rid)
                     result_idx += 1
                     result_set.add(rid)
+            objects = self.__class__(model=self.model).in_bulk(rids)
+            for rid in rids:
+                if rid not in objects:
+                    raise self.model.DoesNotExist("{} with id={} does not exist.".format(self.model._meta.object_name,
+                                                                                       rid))
+                yield objects[rid]
 
     def iterator(self):
         if not self.query.empty:
@@ -744,11 +817,13 @@ class RemoteNSIQuerySet(RemoteQuerySet):
                     if m2m_field is not None:
                         yield from (obj for obj in self._get_as_m2m(m2m_field, rel_id) if not self._exclude(obj))
                     else:
+                        count_func = lambda: self._nsi_impl.get_objects_count(
+                            self.model.url, query=self.query.as_query_string(), model=self.model)
                         yield from (obj for obj in self._nsi.get_objects_with_paging(
                             self.model,
                             lambda page: self._nsi_impl.get_objects(self.model.url, query=self.query.as_query_string(),
                                                          page=page, sort=self.sort, desc=self.desc, model=self.model),
-                            self.query.limit_low, self.query.limit_high) if not self._exclude(obj))
+                            self.query.limit_low, self.query.limit_high, count_func=count_func) if not self._exclude(obj))
 
     def __iter__(self):
         if self._result_cache is None:
@@ -756,6 +831,80 @@ class RemoteNSIQuerySet(RemoteQuerySet):
         else:
             return iter(self._result_cache)
 
+    def aiter(self):
+        """
+        Asynchronous iterator over results: async for obj in queryset.aiter()
+        Filters, sort, slicing and M2M queries work as with iteration of the queryset.
+        Requests share the session of the event loop, run the loop with remote_impl.http_session_async.run_async
+        or call close_async_session before the loop is closed.
+        """
+        return RemoteNSIAsyncIterator(self)
+
+    @asyncio.coroutine
+    def fetch_all_async(self):
+        """
+        Coroutine returning list of all results. Results are cached in the queryset like after list(queryset).
+        From synchronous code: run_async(queryset.fetch_all_async()), see remote_impl.http_session_async.
+        """
+        if self._result_cache is None:
+            iterator = self.aiter()
+            result = []
+            while True:
+                try:
+                    obj = yield from iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                result.append(obj)
+            self._result_cache = result
+        return list(self._result_cache)
+
+    @asyncio.coroutine
+    def _try_to_get_by_id_async(self, query_params):
+        filter_params = dict(query_params)
+        filter_params.update(self.query.simple_filters())
+
+        id_query, not_id_query = self._get_id_query(filter_params)
+
+        if len(not_id_query) > 0:
+            return None
+
+        if len(id_query) > 0:
+            return (yield from self._nsi_async.get_object_by_id_async(self.model, filter_params[id_query.pop()]))
+
+        return None
+
+    @asyncio.coroutine
+    def _get_as_m2m_async(self, field_name, rel_id):
+        """
+        :return: PagesAsync if related objects are requested by M2M url, otherwise list of related objects
+        """
+        field_type, m, direct, m2m = self.model._meta.get_field_by_name(field_name)
+        m2m_field = field_type if direct else field_type.field
+        m2m_url = m2m_field.remote_m2m_reverse_url if direct else m2m_field.remote_m2m_url
+        if m2m_url is not None:
+            rel_model = m2m_field.rel.to if direct else m2m_field.model
+            model_url = rel_model.url
+            return self._nsi_async.get_pages_async(
+                self.model,
+                lambda page: self._nsi_impl_async.get_objects_m2m(model_url, rel_id, m2m_url, page=page,
+                                                                  model=rel_model),
+                self.query.limit_low, self.query.limit_high)
+        through = m2m_field.rel.through
+        through_query = m2m_field.m2m_reverse_name() if direct else m2m_field.m2m_column_name()
+        through_field = m2m_field.m2m_column_name() if direct else m2m_field.m2m_reverse_name()
+        through_objects = through.objects.filter(**{through_query: rel_id})
+        if issubclass(through, django_remote_model.models.RemoteNSIModel):
+            through_objects = yield from through_objects.filter(valid=True).fetch_all_async()
+        rids = []
+        rid_set = set()
+        for rid in (getattr(t, through_field) for t in through_objects):
+            if rid not in rid_set:
+                rids.append(rid)
+                rid_set.add(rid)
+        rids = rids[self.query.limit_low:self.query.limit_high]
+        return (yield from asyncio.gather(*[self._nsi_async.get_object_by_id_async(self.model, rid)
+                                            for rid in rids]))
+
     def get(self, *args, **kwargs):
         """
         Performs the query and returns a single object matching the given
@@ -783,6 +932,67 @@ class RemoteNSIQuerySet(RemoteQuerySet):
         return c
 
 
+class RemoteNSIAsyncIterator:
+    """
+    Asynchronous iterator over results of RemoteNSIQuerySet.
+    Objects are taken from pages of query results, the next page is downloaded while the current one is consumed.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.objects = deque(queryset._result_cache) if queryset._result_cache is not None else None
+        self.pages = None
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        if self.objects is None:
+            self.objects = deque()
+            yield from self._start()
+        while True:
+            while self.objects:
+                obj = self.objects.popleft()
+                if self.queryset._result_cache is not None or not self.queryset._exclude(obj):
+                    return obj
+            if self.pages is None:
+                raise StopAsyncIteration
+            page = yield from self.pages.next_page()
+            if page is None:
+                self.pages = None
+            else:
+                self.objects.extend(page)
+
+    @asyncio.coroutine
+    def _start(self):
+        queryset = self.queryset
+        if queryset.query.empty:
+            return
+        try:
+            result = yield from queryset._try_to_get_by_id_async({})
+        except queryset.model.DoesNotExist:
+            return
+        if result is not None:
+            self.objects.append(result)
+            return
+        m2m_field, rel_id = queryset._try_to_find_m2m_in_query()
+        if m2m_field is not None:
+            result = yield from queryset._get_as_m2m_async(m2m_field, rel_id)
+            if isinstance(result, list):
+                self.objects.extend(result)
+            else:
+                self.pages = result
+        else:
+            self.pages = queryset._nsi_async.get_pages_async(
+                queryset.model,
+                lambda page: queryset._nsi_impl_async.get_objects(queryset.model.url,
+                                                                  query=queryset.query.as_query_string(),
+                                                                  page=page, sort=queryset.sort, desc=queryset.desc,
+                                                                  model=queryset.model),
+                queryset.query.limit_low, queryset.query.limit_high)
+
+
 class RemoteLdapProxyQuerySet(RemoteNSIQuerySet):
     """
     QuerySet which access remote LDAP proxy resources.
@@ -242,7 +242,11 @@ class IdListSerializer:
             return [t.id for t in local_field]
 
     def deserialize(self, remote_field):
-        return [self.model.objects.get(id=id) for id in remote_field]
+        objects = self.model.objects.in_bulk(remote_field)
+        for id in remote_field:
+            if id not in objects:
+                raise self.model.DoesNotExist("{} with id={} does not exist.".format(self.model._meta.object_name, id))
+        return [objects[id] for id in remote_field]
 
 
 class PropertySerializer:
@@ -0,0 +1,241 @@
+import asyncio
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from django_remote_model.query import RemoteNSIQuerySet
+from main_remote.models import Student
+from remote_impl import single_flight
+from remote_impl.server_settings import REMOTE_SETTINGS_TTL, ServerSettingsCache
+from remote_impl.single_flight import SingleFlight, SingleFlightAsync
+
+
+class InBulkTest(SimpleTestCase):
+    """Requests of RemoteNSIQuerySet.in_bulk are replaced with a dictionary of students"""
+
+    def setUp(self):
+        self.students = {id: Student(id=id, last_name="Ivanov", first_name=str(id)) for id in range(1, 8)}
+        self.batches = []
+        self.nsi = mock.Mock()
+        self.nsi.get_cached_objects_by_ids.return_value = {}
+        self.nsi.get_max_query_length.return_value = 4000
+        for patcher in [mock.patch.object(RemoteNSIQuerySet, "_nsi", self.nsi),
+                        mock.patch.object(RemoteNSIQuerySet, "_get_batch_by_ids", self.get_batch_by_ids)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_batch_by_ids(self, ids):
+        self.batches.append(list(ids))
+        return [self.students[id] for id in ids if id in self.students]
+
+    def test_keys_are_ids_as_passed(self):
+        result = RemoteNSIQuerySet(model=Student).in_bulk(["1", 2, 99])
+        self.assertEqual(result, {"1": self.students[1], 2: self.students[2]})
+        self.assertEqual(self.batches, [[1, 2, 99]])
+
+    def test_cached_objects_are_not_requested(self):
+        self.nsi.get_cached_objects_by_ids.return_value = {"3": self.students[3]}
+        result = RemoteNSIQuerySet(model=Student).in_bulk(["3", 4])
+        self.assertEqual(result, {"3": self.students[3], 4: self.students[4]})
+        self.nsi.get_cached_objects_by_ids.assert_called_once_with(Student, ["3", 4])
+        self.assertEqual(self.batches, [[4]])
+
+    def test_cache_is_not_used_with_filters(self):
+        result = RemoteNSIQuerySet(model=Student).filter(last_name="Ivanov").in_bulk([5])
+        self.assertEqual(result, {5: self.students[5]})
+        self.assertFalse(self.nsi.get_cached_objects_by_ids.called)
+
+    def test_batches(self):
+        ids = [1, 2, 3, 4, 5, 1, 100]
+        expected = {id: self.students[id] for id in range(1, 6)}
+        self.assertEqual(RemoteNSIQuerySet(model=Student).in_bulk(ids, batch_size=2, concurrency=1), expected)
+        self.assertEqual(self.batches, [[1, 2], [3, 4], [5, 100]])
+        self.batches = []
+        self.assertEqual(RemoteNSIQuerySet(model=Student).in_bulk(ids, batch_size=2, concurrency=3), expected)
+        self.assertEqual(sorted(self.batches), [[1, 2], [3, 4], [5, 100]])
+
+    def test_batch_size_fits_maximal_query_length(self):
+        self.nsi.get_max_query_length.return_value = 1
+        RemoteNSIQuerySet(model=Student).in_bulk([1, 2, 3])
+        self.assertEqual(self.batches, [[1], [2], [3]])
+
+    def test_no_ids(self):
+        self.assertEqual(RemoteNSIQuerySet(model=Student).in_bulk([]), {})
+        self.assertEqual(self.batches, [])
+
+
+class _CountedCall(single_flight._Call):
+    """Call which lets a test know how many threads wait for it"""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Semaphore(0)
+        wait = self.done.wait
+
+        def counted_wait(*args):
+            self.waiting.release()
+            return wait(*args)
+
+        self.done.wait = counted_wait
+
+
+class SingleFlightTest(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+
+        def call():
+            self.calls.append(_CountedCall())
+            return self.calls[-1]
+
+        patcher = mock.patch.object(single_flight, "_Call", call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_followers(self, flight, key, func, count):
+        """
+        Starts count threads calling func with key while the leader is blocked, returns when all of them wait
+        for the leader
+        """
+        results = [None] * count
+
+        def follower(i):
+            try:
+                results[i] = flight.do(key, func)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=follower, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for _ in range(count):
+            self.assertTrue(self.calls[0].waiting.acquire(timeout=5))
+        return threads, results
+
+    def test_shared_result(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return object()
+
+        leader = threading.Thread(target=lambda: calls.append(flight.do("key", func)))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        threads, results = self.run_followers(flight, "key", func, 3)
+        self.assertEqual(flight.do("other", lambda: "other"), "other")
+        release.set()
+        for thread in threads + [leader]:
+            thread.join(5)
+        result = calls.pop()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [result] * 3)
+        self.assertIsNot(flight.do("key", object), result)
+
+    def test_shared_exception(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        error = ValueError("remote server is unavailable")
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            raise error
+
+        def leader():
+            try:
+                flight.do("key", func)
+            except ValueError as e:
+                calls.append(e)
+
+        leader = threading.Thread(target=leader)
+        leader.start()
+        self.assertTrue(started.wait(5))
+        threads, results = self.run_followers(flight, "key", func, 3)
+        release.set()
+        for thread in threads + [leader]:
+            thread.join(5)
+        self.assertEqual(calls, [1, error])
+        self.assertEqual(results, [error] * 3)
+        self.assertEqual(flight.do("key", lambda: "again"), "again")
+
+
+class SingleFlightAsyncTest(SimpleTestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def test_shared_future(self):
+        flight = SingleFlightAsync()
+        calls = []
+
+        @asyncio.coroutine
+        def func():
+            calls.append(1)
+            yield from asyncio.sleep(0.01)
+            return object()
+
+        results = self.loop.run_until_complete(asyncio.gather(*[flight.do("key", func) for _ in range(3)]))
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [results[0]] * 3)
+        self.assertIsNot(self.loop.run_until_complete(flight.do("key", func)), results[0])
+
+    def test_shared_exception(self):
+        flight = SingleFlightAsync()
+        error = ValueError("remote server is unavailable")
+
+        @asyncio.coroutine
+        def func():
+            yield from asyncio.sleep(0.01)
+            raise error
+
+        results = self.loop.run_until_complete(
+            asyncio.gather(*[flight.do("key", func) for _ in range(3)], return_exceptions=True))
+        self.assertEqual(results, [error] * 3)
+
+
+class ServerSettingsCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("remote_impl.server_settings.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ServerSettingsCache()
+
+    @override_settings(REMOTE_SETTINGS_TTL=10)
+    def test_ttl(self):
+        self.assertIsNone(self.cache.get("http://a/settings"))
+        self.cache.set("http://a/settings", {"max_query_length": 100})
+        self.now += 9.9
+        self.assertEqual(self.cache.get("http://a/settings"), {"max_query_length": 100})
+        self.now += 0.1
+        self.assertIsNone(self.cache.get("http://a/settings"))
+        self.cache.set("http://a/settings", {"max_query_length": 200})
+        self.assertEqual(self.cache.get("http://a/settings"), {"max_query_length": 200})
+
+    def test_default_ttl(self):
+        self.cache.set("http://a/settings", {})
+        with self.settings():
+            del settings.REMOTE_SETTINGS_TTL
+            self.now += REMOTE_SETTINGS_TTL - 1
+            self.assertEqual(self.cache.get("http://a/settings"), {})
+            self.now += 1
+            self.assertIsNone(self.cache.get("http://a/settings"))
+
+    def test_refresh(self):
+        self.cache.set("http://a/settings", {"a": 1})
+        self.cache.set("http://b/settings", {"b": 1})
+        self.cache.refresh("http://a/settings")
+        self.assertIsNone(self.cache.get("http://a/settings"))
+        self.assertEqual(self.cache.get("http://b/settings"), {"b": 1})
+        self.cache.refresh("http://unknown/settings")
+        self.cache.refresh()
+        self.assertIsNone(self.cache.get("http://b/settings"))
@@ -113,6 +113,13 @@ def __get_str_cache_key(s):
     return cache_hash(result)
 
 
+def get_request_key(url):
+    """
+    Key of GET request of the current user with the current role, the same as key of its cached response
+    """
+    return __get_str_cache_key(url)
+
+
 def __get_base_model(model):
     while model._meta.proxy:
         model = model._meta.proxy_for_model
@@ -174,6 +181,25 @@ def get_cached_response(url, model=None):
     return None
 
 
+def get_cached_responses(urls, model=None):
+    """
+    Gets cached responses for many URLs with one request to cache
+    :return: dictionary of URLs and responses for URLs found in cache
+    """
+    try:
+        keys = {__get_str_cache_key(url): url for url in urls}
+        if model is None:
+            found = cache.get_many(list(keys.keys()))
+        else:
+            found = cache.get_many(list(keys.keys()), version=__get_model_cache_version(model))
+        return {keys[key]: FakeResponse(response_json) for key, response_json in found.items()
+                if response_json is not None}
+    except:
+        tb = traceback.format_exc()
+        logger.error("Error while getting responses for {} URLs from cache:\n{}".format(len(urls), str(tb)))
+    return {}
+
+
 def cache_response(url, response, timeout=None, model=None):
     try:
         response_json = response.json()
@@ -1,4 +1,9 @@
 # coding=utf-8
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from crequest.middleware import CrequestMiddleware
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models.constants import LOOKUP_SEP
 from django_remote_model.util.util import nsi_get_query_from_Q
@@ -118,7 +123,41 @@ class Nsi:
 
         return model.get_serializer().deserialize(json_object)
 
-    def get_objects_with_paging(self, model, get_objects_func, limit_low, limit_high):
+    def get_max_query_length(self):
+        """
+        :return: maximal length of encoded query accepted by server, used to size batches of ids
+        """
+        return self.__impl.get_max_query_length()
+
+    def get_cached_objects_by_ids(self, model, ids):
+        """
+        Gets objects, which were requested by id recently, from cache
+        :return: dictionary of ids and deserialized objects found in cache
+        """
+        serializer = model.get_serializer()
+        return {id: serializer.deserialize(res)
+                for id, res in self.__impl.get_cached_objects_by_ids(model.url, ids, model).items()}
+
+    def get_objects_with_paging(self, model, get_objects_func, limit_low, limit_high, count_func=None,
+                                concurrency=None):
+        """
+        Yields deserialized objects from pages of query results in order
+        :param get_objects_func: function of page number returning list of json objects of the page
+        :param limit_low: index of the first object or None
+        :param limit_high: index after the last object or None
+        :param count_func: function returning number of objects of the query, called only if the first page is full,
+            pages are requested one by one without it
+        :param concurrency: maximal number of pages requested at once, settings.NSI_PAGING_CONCURRENCY by default
+        """
+        if concurrency is None:
+            concurrency = getattr(settings, "NSI_PAGING_CONCURRENCY", 1)
+        if count_func is None or concurrency <= 1:
+            yield from self.__get_pages_serially(model, get_objects_func, limit_low, limit_high)
+        else:
+            yield from self.__get_pages_concurrently(model, get_objects_func, limit_low, limit_high, count_func,
+                                                     concurrency)
+
+    def __get_pages_serially(self, model, get_objects_func, limit_low, limit_high):
         page_size = self.__impl.get_page_size()
         page = limit_low // page_size if limit_low is not None else 0
         part_start = limit_low % page_size if limit_low is not None else 0
@@ -142,6 +181,70 @@ class Nsi:
                 if part_end <= 0:
                     break
 
+    def __get_pages_concurrently(self, model, get_objects_func, limit_low, limit_high, count_func, concurrency):
+        """
+        The first page is requested alone. Only if it is full, objects are counted with count_func and the rest
+        of pages in the known range are requested by a pool of threads, no more than concurrency pages are requested
+        or wait to be yielded at once. Pages after the range (objects added after counting) are requested one by one.
+        """
+        page_size = self.__impl.get_page_size()
+        low = limit_low if limit_low is not None else 0
+        first_page = low // page_size
+        serializer = model.get_serializer()
+
+        def get_part(page, objs):
+            part_start = low - page * page_size if page == first_page else 0
+            part_end = limit_high - page * page_size if limit_high is not None else page_size
+            is_last = len(objs) < page_size or (limit_high is not None and part_end <= page_size)
+            return objs[part_start:part_end], is_last
+
+        try:
+            objs = get_objects_func(page=first_page)
+        except RemoteDatabaseError:
+            return
+        part, is_last = get_part(first_page, objs)
+        for res in part:
+            yield serializer.deserialize(res)
+        if is_last or len(part) == 0:
+            return
+        high = count_func()
+        if limit_high is not None:
+            high = min(high, limit_high)
+        last_page = (high - 1) // page_size
+        pages = iter(range(first_page + 1, last_page + 1))
+        # Requests take authentication from the current request, which is stored per thread
+        request = CrequestMiddleware.get_request()
+
+        def get_page(page):
+            CrequestMiddleware.set_request(request)
+            return get_objects_func(page=page)
+
+        futures = deque()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for page in islice(pages, concurrency):
+                futures.append((page, executor.submit(get_page, page)))
+            while futures:
+                page, future = futures.popleft()
+                try:
+                    objs = future.result()
+                except RemoteDatabaseError:
+                    return
+                next_page = next(pages, None)
+                if next_page is not None:
+                    futures.append((next_page, executor.submit(get_page, next_page)))
+                part, is_last = get_part(page, objs)
+                for res in part:
+                    yield serializer.deserialize(res)
+                if is_last:
+                    return
+        finally:
+            for page, future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+        next_low = (max(last_page, first_page) + 1) * page_size
+        yield from self.__get_pages_serially(model, get_objects_func, next_low, limit_high)
+
     def create_object(self, obj):
         serializer = obj.get_serializer()
         result_json = self.__impl.create_object(obj.url, serializer.serialize(obj), obj._meta.model)
@@ -124,30 +124,28 @@ class NsiAsync:
 
         return model.get_serializer().deserialize(json_object)
 
+    def get_pages_async(self, model, get_objects_func, limit_low, limit_high):
+        """
+        Pages of query results for asynchronous code
+        :param get_objects_func: coroutine function of page number returning list of json objects of the page
+        :return: PagesAsync, call its coroutine next_page to get lists of deserialized objects
+        """
+        return PagesAsync(self.__impl, model, get_objects_func, limit_low, limit_high)
+
     @asyncio.coroutine
     def get_objects_with_paging_async(self, model, get_objects_func, limit_low, limit_high):
-        page_size = yield from self.__impl.get_page_size()
-        page = limit_low // page_size if limit_low is not None else 0
-        part_start = limit_low % page_size if limit_low is not None else 0
-        part_end = limit_high - page * page_size if limit_high is not None else page_size
+        """
+        All deserialized objects of query results from limit_low to limit_high, see get_pages_async
+        :param get_objects_func: coroutine function of page number returning list of json objects of the page
+        :return: list of deserialized objects
+        """
+        pages = self.get_pages_async(model, get_objects_func, limit_low, limit_high)
+        objects = []
         while True:
-            try:
-                objs = get_objects_func(page=page)
-            except RemoteDatabaseError:
-                break
-            result_part = objs[part_start:part_end]
-            if len(result_part) == 0:
-                break
-            for res in result_part:
-                yield model.get_serializer().deserialize(res)
-            if len(objs) < page_size:
-                break
-            page += 1
-            part_start = 0
-            if limit_high is not None:
-                part_end -= page_size
-                if part_end <= 0:
-                    break
+            page = yield from pages.next_page()
+            if page is None:
+                return objects
+            objects.extend(page)
 
     @asyncio.coroutine
     def create_object_async(self, obj):
@@ -202,4 +200,64 @@ class NsiAsync:
         return [serializer.deserialize(perm) for perm in perms]
 
 
+class PagesAsync:
+    """
+    Deserialized objects from pages of query results from limit_low to limit_high.
+    Request of the next page is sent before the current page is deserialized, so download of the next page
+    overlaps with deserialization and processing of the current one.
+    """
+
+    def __init__(self, impl, model, get_objects_func, limit_low, limit_high):
+        self.__impl = impl
+        self.__model = model
+        self.__get_objects_func = get_objects_func
+        self.__limit_low = limit_low
+        self.__limit_high = limit_high
+        self.__page_size = None
+        self.__next = None
+        self.__done = False
+
+    @asyncio.coroutine
+    def next_page(self):
+        """
+        :return: list of deserialized objects of the next page or None if there are no more pages
+        """
+        if self.__done:
+            return None
+        if self.__page_size is None:
+            self.__page_size = yield from self.__impl.get_page_size()
+            self.__page = self.__limit_low // self.__page_size if self.__limit_low is not None else 0
+            self.__part_start = self.__limit_low % self.__page_size if self.__limit_low is not None else 0
+            self.__part_end = self.__limit_high - self.__page * self.__page_size if self.__limit_high is not None \
+                else self.__page_size
+            self.__next = asyncio.ensure_future(self.__get_objects_func(page=self.__page))
+        try:
+            objs = yield from self.__next
+        except RemoteDatabaseError:
+            objs = []
+        self.__next = None
+        result_part = objs[self.__part_start:self.__part_end]
+        self.__page += 1
+        self.__part_start = 0
+        if self.__limit_high is not None:
+            self.__part_end -= self.__page_size
+        if len(result_part) == 0 or len(objs) < self.__page_size or self.__part_end <= 0:
+            self.__done = True
+        else:
+            self.__next = asyncio.ensure_future(self.__get_objects_func(page=self.__page))
+            # let the request of the next page start before deserialization
+            yield from asyncio.sleep(0)
+        if len(result_part) == 0:
+            return None
+        serializer = self.__model.get_serializer()
+        return [serializer.deserialize(res) for res in result_part]
+
+    def cancel(self):
+        """Stop requesting pages, e.g. if the rest of results is not needed"""
+        self.__done = True
+        if self.__next is not None:
+            self.__next.cancel()
+            self.__next = None
+
+
 nsi_async = NsiAsync()
@@ -3,8 +3,6 @@ import base64
 import json
 import logging
 
-import aiohttp
-import requests
 from aiohttp.helpers import BasicAuth
 from crequest.middleware import CrequestMiddleware
 from django.conf import settings
@@ -13,8 +11,12 @@ from requests.status_codes import codes
 import main_remote
 from django_remote_model.util.query_log import info, error
 from django_remote_model.util.util import query_quote, invalidate_cache_for_model, get_cached_response, \
-    cache_response, FakeResponse
+    cache_response, get_request_key
+from remote_impl.http_session import get_session
+from remote_impl.http_session_async import request_async
 from remote_impl.remote_database_exception import RemoteDatabaseError
+from remote_impl.server_settings import server_settings
+from remote_impl.single_flight import single_flight, single_flight_async
 
 logger = logging.getLogger('polyana_web')
 
@@ -71,10 +73,16 @@ class CoreImpl:
         if response is not None:
             return response
         kwargs = self.prepare_request_kwargs(kwargs)
-        response = requests.get(url, **kwargs)
-        if response.status_code == codes.ok:
-            cache_response(url, response, timeout=cache_timeout, model=model)
-        return response
+
+        def get():
+            response = get_session().get(url, **kwargs)
+            # body is read before the response is shared with waiting threads
+            response.content
+            if response.status_code == codes.ok:
+                cache_response(url, response, timeout=cache_timeout, model=model)
+            return response
+
+        return single_flight.do(get_request_key(url), get)
 
     @asyncio.coroutine
     def auth_get_async(self, url, cache_timeout=None, model=None, **kwargs):
@@ -87,14 +95,14 @@ class CoreImpl:
         if isinstance(auth, tuple):
             kwargs["auth"] = BasicAuth(login=auth[0], password=auth[1])
 
-        with aiohttp.ClientSession() as session:
-            response = yield from session.get(url, **kwargs)
-            js = yield from response.json()
-            response = FakeResponse(js, status_code=response.status)
+        @asyncio.coroutine
+        def get():
+            response = yield from request_async("GET", url, **kwargs)
+            if response.status_code == codes.ok:
+                cache_response(url, response, timeout=cache_timeout, model=model)
+            return response
 
-        if response.status_code == codes.ok:
-            cache_response(url, response, timeout=cache_timeout, model=model)
-        return response
+        return (yield from single_flight_async.do(get_request_key(url), get))
 
     def auth_post(self, url, data, model=None, **kwargs):
         headers = kwargs.get("headers", {})
@@ -103,22 +111,36 @@ class CoreImpl:
         kwargs = self.prepare_request_kwargs(kwargs)
         if model is not None:
             invalidate_cache_for_model(model)
-        return requests.post(url, json.dumps(data), **kwargs)
+        return get_session().post(url, json.dumps(data), **kwargs)
 
     def auth_delete(self, url, model=None, **kwargs):
         kwargs = self.prepare_request_kwargs(kwargs)
         if model is not None:
             invalidate_cache_for_model(model)
-        return requests.delete(url, **kwargs)
-
-    def get_page_size(self):
+        return get_session().delete(url, **kwargs)
+
+    def get_settings(self, refresh=False):
+        """
+        Gets server settings, they are cached in the process (see ServerSettingsCache)
+        :param refresh: request settings even if they are cached
+        :return: json object of server settings
+        """
+        if refresh:
+            server_settings.refresh(self.__settings_url)
+        result = server_settings.get(self.__settings_url)
+        if result is not None:
+            return result
         r = self.auth_get(self.__settings_url)
         if r.status_code == codes.ok:
-            paging = r.json()["paging"]
-            return paging
+            result = r.json()
+            server_settings.set(self.__settings_url, result)
+            return result
         else:
             raise RemoteDatabaseError(remote_error_json=self.__json_or_none(r))
 
+    def get_page_size(self):
+        return self.get_settings()["paging"]
+
     # TODO remove this later
     def get_report_types(self):
         params = {
@@ -0,0 +1,65 @@
+# coding=utf-8
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+# Defaults for settings, which may be absent in the project settings
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.3
+# Seconds to connect and to wait for a response
+HTTP_TIMEOUT = (5, 60)
+
+
+class PooledSession(requests.Session):
+    """
+    Session with default timeout. Sessions of all threads share one adapter, i.e. one pool of keep-alive
+    connections per host, while cookies and other session state are kept per thread.
+    """
+
+    def __init__(self, adapter, timeout):
+        super().__init__()
+        self.timeout = timeout
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_adapter():
+    """
+    Adapter with pool of connections of size settings.HTTP_POOL_SIZE for each host.
+    Failed connections are retried settings.HTTP_RETRIES times with backoff settings.HTTP_BACKOFF_FACTOR.
+    Requests, which were sent, are not repeated, responses with any status are returned to the caller.
+    """
+    pool_size = getattr(settings, "HTTP_POOL_SIZE", HTTP_POOL_SIZE)
+    # Arguments are limited to those of urllib3 bundled with requests 2.6
+    retries = Retry(total=getattr(settings, "HTTP_RETRIES", HTTP_RETRIES), read=0,
+                    backoff_factor=getattr(settings, "HTTP_BACKOFF_FACTOR", HTTP_BACKOFF_FACTOR))
+    return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+
+
+_adapter = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_session():
+    """
+    Session of the current thread, use it instead of requests.get, requests.post, etc.
+    Timeout is settings.HTTP_TIMEOUT unless it is given in arguments of a request.
+    """
+    global _adapter
+    session = getattr(_local, "session", None)
+    if session is None:
+        with _adapter_lock:
+            if _adapter is None:
+                _adapter = create_adapter()
+        session = PooledSession(_adapter, getattr(settings, "HTTP_TIMEOUT", HTTP_TIMEOUT))
+        _local.session = session
+    return session
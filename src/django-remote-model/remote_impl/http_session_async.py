@@ -0,0 +1,121 @@
+# coding=utf-8
+import asyncio
+import json
+import weakref
+from urllib.parse import urlsplit
+
+import aiohttp
+from django.conf import settings
+
+from django_remote_model.util.util import FakeResponse
+from remote_impl.http_session import HTTP_POOL_SIZE
+
+# Defaults for settings, which may be absent in the project settings
+HTTP_ASYNC_LIMIT = 30
+HTTP_ASYNC_CONCURRENCY = 10
+
+# Sessions, semaphores and dictionaries of hosts and their semaphores of event loops,
+# they are forgotten with their loops
+_sessions = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+_host_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_async_session(loop=None):
+    """
+    Client session shared by all requests in the event loop (the current one by default), created on first use.
+    Its connector keeps at most settings.HTTP_ASYNC_LIMIT connections. Connector of the pinned aiohttp has no
+    limit per host, it is kept by get_host_semaphore.
+    """
+    loop = loop or asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=getattr(settings, "HTTP_ASYNC_LIMIT", HTTP_ASYNC_LIMIT), loop=loop)
+        session = aiohttp.ClientSession(connector=connector, loop=loop)
+        _sessions[loop] = session
+    return session
+
+
+def get_async_semaphore(loop=None):
+    """Semaphore limiting number of requests in progress in the event loop to settings.HTTP_ASYNC_CONCURRENCY"""
+    loop = loop or asyncio.get_event_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(getattr(settings, "HTTP_ASYNC_CONCURRENCY", HTTP_ASYNC_CONCURRENCY), loop=loop)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+def get_host_semaphore(url, loop=None):
+    """
+    Semaphore limiting number of requests in progress in the event loop to the host of url
+    to settings.HTTP_POOL_SIZE
+    """
+    loop = loop or asyncio.get_event_loop()
+    semaphores = _host_semaphores.setdefault(loop, {})
+    host = urlsplit(url).netloc
+    semaphore = semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(getattr(settings, "HTTP_POOL_SIZE", HTTP_POOL_SIZE), loop=loop)
+        semaphores[host] = semaphore
+    return semaphore
+
+
+def start_async_session(loop=None):
+    """Startup hook: create the session of the event loop in advance"""
+    return get_async_session(loop)
+
+
+@asyncio.coroutine
+def close_async_session(loop=None):
+    """
+    Shutdown hook: close the session of the event loop with its connections. Call it before the loop is closed
+    (run_async does it), otherwise connections of the session are leaked.
+    """
+    loop = loop or asyncio.get_event_loop()
+    session = _sessions.pop(loop, None)
+    _semaphores.pop(loop, None)
+    _host_semaphores.pop(loop, None)
+    if session is not None and not session.closed:
+        result = session.close()
+        # close is a coroutine in new versions of aiohttp
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            yield from result
+
+
+def run_async(coroutine, loop=None):
+    """
+    Run coroutine (e.g. fetch_all_async of a queryset) from synchronous code with session hooks: the session of
+    the loop is created before the coroutine and closed after it. Without loop a new event loop is made current,
+    then closed and unset at the end.
+    :return: result of the coroutine
+    """
+    own_loop = loop is None
+    if own_loop:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    try:
+        start_async_session(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(close_async_session(loop))
+        if own_loop:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+
+@asyncio.coroutine
+def request_async(method, url, **kwargs):
+    """
+    Send request with the shared session of the current event loop, the number of requests in progress is limited
+    in total and per host. The body is read at once, so the connection returns to the pool.
+    :return: FakeResponse with json of the body, json is None if the body is not json
+    """
+    with (yield from get_async_semaphore()), (yield from get_host_semaphore(url)):
+        response = yield from get_async_session().request(method, url, **kwargs)
+        body = yield from response.text()
+    try:
+        js = json.loads(body)
+    except ValueError:
+        js = None
+    return FakeResponse(js, status_code=response.status)
@@ -3,7 +3,7 @@ import base64
 import urllib
 
 from django_remote_model.util.util import query_quote, get_cached_response, cache_response, \
-    invalidate_cache_for_model
+    invalidate_cache_for_model, get_cached_responses, get_request_key
 from crequest.middleware import CrequestMiddleware
 from django_remote_model.util.query_log import info, error
 import requests
@@ -14,10 +14,17 @@ from requests.status_codes import codes
 import logging
 import main_remote
 import polyauth_remote
+from remote_impl.http_session import get_session
 from remote_impl.remote_database_exception import RemoteDatabaseError
+from remote_impl.server_settings import server_settings
+from remote_impl.single_flight import single_flight
 
 logger = logging.getLogger('polyana_web')
 
+# Name of server setting with maximal length of query and its default, if server does not report it
+MAX_QUERY_LENGTH_SETTING = "maxQueryLength"
+NSI_MAX_QUERY_LENGTH = 4000
+
 
 class NsiImpl:
     def __init__(self, server_uri=settings.NSI_SERVER_URI, api_path=settings.NSI_API_PATH):
@@ -55,8 +62,8 @@ class NsiImpl:
 
     def bp_authenticate(self, username, password):
         bp_auth_header = requests.auth._basic_auth_str(username, password)
-        r = requests.get(self.__server_uri + self.__api_path + "/businessprocess/auth",
-                         headers={"X-BP-Authorization": bp_auth_header})
+        r = get_session().get(self.__server_uri + self.__api_path + "/businessprocess/auth",
+                              headers={"X-BP-Authorization": bp_auth_header})
         return r.status_code == codes.ok
 
     def prepare_request_kwargs(self, kwargs):
@@ -78,10 +85,16 @@ class NsiImpl:
         if response is not None:
             return response
         kwargs = self.prepare_request_kwargs(kwargs)
-        response = requests.get(url, **kwargs)
-        if response.status_code == codes.ok:
-            cache_response(url, response, timeout=cache_timeout, model=model)
-        return response
+
+        def get():
+            response = get_session().get(url, **kwargs)
+            # body is read before the response is shared with waiting threads
+            response.content
+            if response.status_code == codes.ok:
+                cache_response(url, response, timeout=cache_timeout, model=model)
+            return response
+
+        return single_flight.do(get_request_key(url), get)
 
     def auth_post(self, url, data, model=None, **kwargs):
         kwargs = self.prepare_request_kwargs(kwargs)
@@ -90,13 +103,13 @@ class NsiImpl:
         kwargs["headers"] = headers
         if model is not None:
             invalidate_cache_for_model(model)
-        return requests.post(url, json.dumps(data), **kwargs)
+        return get_session().post(url, json.dumps(data), **kwargs)
 
     def auth_delete(self, url, model=None, **kwargs):
         kwargs = self.prepare_request_kwargs(kwargs)
         if model is not None:
             invalidate_cache_for_model(model)
-        return requests.delete(url, **kwargs)
+        return get_session().delete(url, **kwargs)
 
     def paternity_test(self, child, father):
         """
@@ -156,19 +169,43 @@ class NsiImpl:
         else:
             return None
 
-    def get_page_size(self):
+    def get_settings(self, refresh=False):
+        """
+        Gets server settings, they are cached in the process (see ServerSettingsCache)
+        :param refresh: request settings even if they are cached
+        :return: json object of server settings
+        """
         _url = self.__server_uri + self.__api_path + "/private/settings"
+        if refresh:
+            server_settings.refresh(_url)
+        result = server_settings.get(_url)
+        if result is not None:
+            return result
         r = self.auth_get(_url)
         if r.status_code == codes.ok:
-            info("nsi.get_page_size", _url, r)
-            paging = r.json()["paging"]
-            return paging
+            info("nsi.get_settings", _url, r)
+            result = r.json()
+            server_settings.set(_url, result)
+            return result
         else:
-            error("nsi.get_page_size", _url, r)
+            error("nsi.get_settings", _url, r)
             raise RemoteDatabaseError(remote_error_json=self.__json_or_none(r))
 
+    def get_page_size(self):
+        return self.get_settings()["paging"]
+
+    def get_max_query_length(self):
+        """
+        :return: maximal length of encoded query reported by server or settings.NSI_MAX_QUERY_LENGTH
+        """
+        return self.get_settings().get(MAX_QUERY_LENGTH_SETTING,
+                                       getattr(settings, "NSI_MAX_QUERY_LENGTH", NSI_MAX_QUERY_LENGTH))
+
+    def __get_object_url(self, url, id):
+        return self.__server_uri + self.__api_path + url + "/" + urllib.parse.quote(str(id), safe="")
+
     def get_object_by_id(self, url, id, model):
-        _url = self.__server_uri + self.__api_path + url + "/" + urllib.parse.quote(str(id), safe="")
+        _url = self.__get_object_url(url, id)
         r = self.auth_get(_url, model=model)
         if r.status_code == codes.ok:
             info("nsi.get_object_by_id", _url, r)
@@ -181,6 +218,20 @@ class NsiImpl:
             error("nsi.get_object_by_id", _url, r)
             raise RemoteDatabaseError(remote_error_json=self.__json_or_none(r))
 
+    def get_cached_objects_by_ids(self, url, ids, model):
+        """
+        Gets objects, which responses to get_object_by_id are in cache, without requests to NSI
+        :return: dictionary of ids and json objects found in cache
+        """
+        urls = {self.__get_object_url(url, id): id for id in ids}
+        responses = get_cached_responses(list(urls.keys()), model=model)
+        result = {}
+        for _url, response in responses.items():
+            res = self.__json_or_none(response)
+            if res is not None:
+                result[urls[_url]] = res
+        return result
+
     def get_objects(self, url, query=None, page=0, sort=None, desc=None, model=None):
         query_url = self.__server_uri + self.__api_path + url
         if query is not None:
@@ -1,14 +1,13 @@
 # coding=utf-8
 import asyncio
 
-import aiohttp
 import base64
 import urllib
 
 from aiohttp.helpers import BasicAuth
 
 from django_remote_model.util.util import query_quote, get_cached_response, cache_response, \
-    invalidate_cache_for_model, FakeResponse
+    invalidate_cache_for_model, get_request_key
 from crequest.middleware import CrequestMiddleware
 from django_remote_model.util.query_log import info, error
 import requests
@@ -19,7 +18,11 @@ from requests.status_codes import codes
 import logging
 import main_remote
 import polyauth_remote
+from remote_impl.http_session import get_session
+from remote_impl.http_session_async import request_async
 from remote_impl.remote_database_exception import RemoteDatabaseError
+from remote_impl.server_settings import server_settings
+from remote_impl.single_flight import single_flight_async
 
 logger = logging.getLogger('polyana_web')
 
@@ -60,8 +63,8 @@ class NsiImplAsync(object):
 
     def bp_authenticate(self, username, password):
         bp_auth_header = requests.auth._basic_auth_str(username, password)
-        r = requests.get(self.__server_uri + self.__api_path + "/businessprocess/auth",
-                         headers={"X-BP-Authorization": bp_auth_header})
+        r = get_session().get(self.__server_uri + self.__api_path + "/businessprocess/auth",
+                              headers={"X-BP-Authorization": bp_auth_header})
         return r.status_code == codes.ok
 
     @asyncio.coroutine
@@ -80,12 +83,15 @@ class NsiImplAsync(object):
             if bp_auth is not None:
                 headers["X-BP-Authorization"] = bp_auth
             kwargs["headers"] = headers
-            with aiohttp.ClientSession() as session:
-                response = yield from session.get(url, **kwargs)
-                js = yield from response.json()
-                response = FakeResponse(js, status_code=response.status)
+
+            @asyncio.coroutine
+            def get():
+                response = yield from request_async("GET", url, **kwargs)
                 if response.status_code == codes.ok:
                     cache_response(url, response, timeout=cache_timeout, model=model)
+                return response
+
+            response = yield from single_flight_async.do(get_request_key(url), get)
         return response
 
     @asyncio.coroutine
@@ -105,8 +111,7 @@ class NsiImplAsync(object):
         kwargs["headers"] = headers
         if model is not None:
             invalidate_cache_for_model(model)
-        with aiohttp.ClientSession() as session:
-            yield from session.post(url, data=json.dumps(data), **kwargs)
+        return (yield from request_async("POST", url, data=json.dumps(data), **kwargs))
 
     @asyncio.coroutine
     def auth_delete_async(self, url, model=None, **kwargs):
@@ -123,8 +128,7 @@ class NsiImplAsync(object):
         kwargs["headers"] = headers
         if model is not None:
             invalidate_cache_for_model(model)
-        with aiohttp.ClientSession() as session:
-            yield from session.delete(url, **kwargs)
+        return (yield from request_async("DELETE", url, **kwargs))
 
     @asyncio.coroutine
     def paternity_test(self, child, father):
@@ -189,17 +193,28 @@ class NsiImplAsync(object):
             return None
 
     @asyncio.coroutine
-    def get_page_size(self):
+    def get_settings(self, refresh=False):
         _url = self.__server_uri + self.__api_path + "/private/settings"
+        if refresh:
+            server_settings.refresh(_url)
+        result = server_settings.get(_url)
+        if result is not None:
+            return result
         r = yield from self.auth_get_async(_url)
         if r.status_code == codes.ok:
-            info("nsi.get_page_size", _url, r)
-            paging = r.json()["paging"]
-            return paging
+            info("nsi.get_settings", _url, r)
+            result = r.json()
+            server_settings.set(_url, result)
+            return result
         else:
-            error("nsi.get_page_size", _url, r)
+            error("nsi.get_settings", _url, r)
             raise RemoteDatabaseError(remote_error_json=self.__json_or_none(r))
 
+    @asyncio.coroutine
+    def get_page_size(self):
+        result = yield from self.get_settings()
+        return result["paging"]
+
     @asyncio.coroutine
     def get_object_by_id(self, url, id, model):
         _url = self.__server_uri + self.__api_path + url + "/" + urllib.parse.quote(str(id), safe="")
@@ -0,0 +1,45 @@
+# coding=utf-8
+import threading
+from time import time
+
+from django.conf import settings
+
+# Default for settings.REMOTE_SETTINGS_TTL, which may be absent in the project settings
+REMOTE_SETTINGS_TTL = 600
+
+
+class ServerSettingsCache:
+    """
+    Settings of remote servers (json objects from their settings URLs) kept in the process memory
+    for settings.REMOTE_SETTINGS_TTL seconds, so paged queries do not request them every time.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__entries = {}
+
+    def get(self, url):
+        """
+        :return: settings from url or None if they are not cached or expired
+        """
+        ttl = getattr(settings, "REMOTE_SETTINGS_TTL", REMOTE_SETTINGS_TTL)
+        with self.__lock:
+            entry = self.__entries.get(url)
+        if entry is None or time() - entry[1] >= ttl:
+            return None
+        return entry[0]
+
+    def set(self, url, value):
+        with self.__lock:
+            self.__entries[url] = (value, time())
+
+    def refresh(self, url=None):
+        """Forget settings from url or all settings, they are requested again on next use"""
+        with self.__lock:
+            if url is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(url, None)
+
+
+server_settings = ServerSettingsCache()
@@ -0,0 +1,68 @@
+# coding=utf-8
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Calls with equal keys made at the same time by different threads share one call of the function:
+    the first thread calls it, others wait for its result (or exception).
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    def do(self, key, func):
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+        return call.result
+
+
+class SingleFlightAsync:
+    """
+    Coroutines with equal keys started in the same event loop before the first of them is finished share one
+    future. Cancellation of a waiting coroutine does not cancel the shared future.
+    """
+
+    def __init__(self):
+        self.__futures = {}
+
+    @asyncio.coroutine
+    def do(self, key, coroutine_func):
+        key = (asyncio.get_event_loop(), key)
+        future = self.__futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coroutine_func())
+            self.__futures[key] = future
+            future.add_done_callback(lambda f: self.__futures.pop(key, None))
+        return (yield from asyncio.shield(future))
+
+
+single_flight = SingleFlight()
+single_flight_async = SingleFlightAsync()